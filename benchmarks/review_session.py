@@ -0,0 +1,331 @@
+"""Simulate a review session to measure what the template filter costs per card.
+
+Run from the repository's root in an environment with the packages of requirements.txt installed:
+
+    python benchmarks/review_session.py
+
+A synthetic collection is created with a notetype of sentence notes to search, and a vocabulary
+notetype whose answer template uses the filter. The question and answer of each card are rendered
+through filter.add_filter() the way Anki renders them in the reviewer, once for each scenario of
+filter options. Per-card render latency percentiles, the number of placeholders shown instead of
+results that ran over the time budget of the filter, and the growth of the stored filter results
+are reported for each scenario.
+"""
+
+import argparse
+import importlib.util
+import json
+import os
+import random
+import re
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import types
+from typing import Any, Callable, Dict, List, Optional, Set
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+import anki.collection  # imported first to avoid a circular import of anki.cards
+import anki.lang
+import aqt
+from anki.cards import Card
+from anki.collection import Collection
+from anki.notes import Note
+from aqt.qt import QApplication
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SRC_DIR = os.path.join(ROOT, "src")
+PACKAGE = "copy_around"
+CHARS = "猫狗我你他的是不了在人有这个们来到时大地为子中说生国年着就那和要"
+FILTER = "{{{{copyaround notetype=subs2srs search_in=Expression leech_from={fields} count=3 {options}:Word}}}}"
+SCENARIOS = {
+    "plain": "shuffle=false",
+    "delayed": "shuffle=false delayed=true",
+    "subs2srs": "shuffle=false subs2srs=true",
+    "other_col": "shuffle=false other_col=true",
+    "shuffle": "shuffle=true",
+}
+TEMPLATE_FILTER_RE = re.compile(r"\{\{([^{}]+)\}\}")
+
+
+class AddonManager:
+    def getConfig(self, module: str) -> Dict[str, Any]:
+        with open(os.path.join(SRC_DIR, "config.json"), encoding="utf-8") as file:
+            return json.load(file)
+
+    def setWebExports(self, module: str, pattern: str) -> None:
+        pass
+
+
+class WebView:
+    def __init__(self) -> None:
+        self.evals: List[str] = []
+
+    def eval(self, js: str) -> None:
+        self.evals.append(js)
+
+
+class TaskManager:
+    """Runs background tasks right away, so that their cost is included in the render."""
+
+    def run_in_background(self, task: Callable, on_done: Callable) -> None:
+        from concurrent.futures import Future
+
+        future: Future = Future()
+        try:
+            future.set_result(task())
+        except Exception as exc:
+            future.set_exception(exc)
+        on_done(future)
+
+    def run_on_main(self, func: Callable) -> None:
+        func()
+
+
+class Subs2srsContext:
+    """Stands in for the subs2srs-context add-on, looking up the notes next to a sentence."""
+
+    def __init__(self, col: Collection) -> None:
+        self.col = col
+
+    def _neighbour(self, nid: int, col: Optional[Collection]) -> Optional[Note]:
+        col = col or self.col
+        before = col.db.scalar(
+            "select id from notes where id < ? order by id desc limit 1", nid
+        )
+        return col.get_note(before) if before else None
+
+    def get_audio_buttons(self, nid: int, flip: bool = False, col=None) -> List[str]:
+        return ['<a class="replay-button"></a>', '<a class="replay-button"></a>']
+
+    def get_audio_filename(self, nid: int, col=None) -> str:
+        note = self._neighbour(nid, col)
+        return re.sub(r"\[sound:(.*)\]", r"\1", note["Audio"]) if note else ""
+
+    def get_expressions(self, nid: int, col=None) -> List[str]:
+        note = self._neighbour(nid, col)
+        return [note["Expression"] if note else "", ""]
+
+
+class RenderContext:
+    """Stands in for anki.template.TemplateRenderContext, with the parts used by the filter."""
+
+    def __init__(self, card: Card, note: Note) -> None:
+        self._card = card
+        self._note = note
+        self.extra_state: Dict[str, Any] = {}
+
+    def card(self) -> Card:
+        return self._card
+
+    def note(self) -> Note:
+        return self._note
+
+
+def make_collection(path: str, sentences: int, seed: int) -> Collection:
+    col = Collection(path)
+    models = col.models
+    notetype = models.new("subs2srs")
+    for name in ["Expression", "Meaning", "Snapshot", "Audio"]:
+        models.add_field(notetype, models.new_field(name))
+    template = models.new_template("Card 1")
+    template["qfmt"] = "{{Expression}}"
+    template["afmt"] = "{{Meaning}}"
+    models.add_template(notetype, template)
+    models.add(notetype)
+    notetype = models.by_name("subs2srs")
+    rand = random.Random(seed)
+    for i in range(sentences):
+        note = col.new_note(notetype)
+        note["Expression"] = "".join(
+            rand.choice(CHARS) for _ in range(rand.randint(6, 20))
+        )
+        note["Meaning"] = f"meaning {i}"
+        note["Snapshot"] = f'<img src="snapshot-{i}.jpg">'
+        note["Audio"] = f"[sound:audio-{i}.mp3]"
+        col.add_note(note, 1)
+    return col
+
+
+def set_vocab_templates(col: Collection, qfmt: str, afmt: str) -> None:
+    notetype = col.models.by_name("Vocab")
+    notetype["tmpls"][0]["qfmt"] = qfmt
+    notetype["tmpls"][0]["afmt"] = afmt
+    col.models.update_dict(notetype)
+
+
+def add_vocab(col: Collection, cards: int, seed: int) -> List[Card]:
+    models = col.models
+    notetype = models.new("Vocab")
+    models.add_field(notetype, models.new_field("Word"))
+    template = models.new_template("Card 1")
+    template["qfmt"] = "{{Word}}"
+    template["afmt"] = "{{Word}}"
+    models.add_template(notetype, template)
+    models.add(notetype)
+    notetype = models.by_name("Vocab")
+    rand = random.Random(seed)
+    result = []
+    for _ in range(cards):
+        note = col.new_note(notetype)
+        note["Word"] = "".join(rand.choice(CHARS) for _ in range(2))
+        col.add_note(note, 1)
+        result.append(note.cards()[0])
+    return result
+
+
+def load_addon(mw: Any) -> types.ModuleType:
+    aqt.mw = mw
+    spec = importlib.util.spec_from_file_location(
+        PACKAGE,
+        os.path.join(SRC_DIR, "__init__.py"),
+        submodule_search_locations=[SRC_DIR],
+    )
+    addon = importlib.util.module_from_spec(spec)
+    sys.modules[PACKAGE] = addon
+    spec.loader.exec_module(addon)
+    return importlib.import_module(f"{PACKAGE}.filter")
+
+
+def deep_size(obj: Any, seen: Optional[Set[int]] = None) -> int:
+    """Return the approximate memory used by `obj` and everything it references,
+    except collections, modules and classes."""
+    if seen is None:
+        seen = set()
+    if id(obj) in seen or isinstance(obj, (Collection, type, types.ModuleType)):
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(deep_size(k, seen) + deep_size(v, seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(deep_size(item, seen) for item in obj)
+    else:
+        if hasattr(obj, "__dict__"):
+            size += deep_size(vars(obj), seen)
+        for slot in getattr(type(obj), "__slots__", ()):
+            if hasattr(obj, slot):
+                size += deep_size(getattr(obj, slot), seen)
+    return size
+
+
+def render_card(filter_module: types.ModuleType, card: Card, note: Note) -> int:
+    """Render a card and return the number of placeholders shown instead of results."""
+    # Anki renders the question and the answer together with a single context when the question
+    # is shown, and caches the output on the card for when the answer is shown
+    ctx = RenderContext(card, note)
+    templates = card.template()
+    pending = 0
+    for template in (templates["qfmt"], templates["afmt"]):
+        for match in TEMPLATE_FILTER_RE.finditer(template):
+            *filter_names, field_name = match.group(1).split(":")
+            if field_name == "FrontSide":
+                # the rendered question is reused as is
+                continue
+            for filter_name in reversed(filter_names):
+                output = filter_module.add_filter(
+                    note[field_name], field_name, filter_name, ctx
+                )
+                pending += 'class="copyaround-pending"' in output
+    return pending
+
+
+def wait_for_lookups(lookups: types.ModuleType) -> None:
+    """Wait for the lookups running in the background to finish, along with their callbacks."""
+    # the lookup threads only all reach the barrier once they're done with the lookups queued before
+    barrier = threading.Barrier(lookups.LOOKUP_THREADS + 1)
+    for _ in range(lookups.LOOKUP_THREADS):
+        lookups._lookup_executor.submit(barrier.wait)
+    barrier.wait()
+
+
+def percentile(values: List[float], ratio: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * ratio))]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--cards", type=int, default=200, help="number of cards reviewed"
+    )
+    parser.add_argument(
+        "--sentences", type=int, default=10000, help="number of notes searched"
+    )
+    parser.add_argument(
+        "--scenario",
+        action="append",
+        choices=list(SCENARIOS),
+        help="scenario to run (can be repeated; all by default)",
+    )
+    parser.add_argument(
+        "--budget",
+        type=int,
+        help="time budget of the filter in milliseconds (the one of config.json by default, 0 to always wait)",
+    )
+    args = parser.parse_args()
+
+    app = QApplication.instance() or QApplication([])
+    # Anki sets up the language on startup, which the stripping of HTML relies on
+    anki.lang.set_lang("en")
+    folder = tempfile.mkdtemp(prefix="copyaround-bench-")
+    print(f"creating collections with {args.sentences} sentence notes...")
+    col = make_collection(os.path.join(folder, "main.anki2"), args.sentences, 1)
+    other_col = make_collection(os.path.join(folder, "other.anki2"), args.sentences, 2)
+    cards = add_vocab(col, args.cards, 3)
+    web = WebView()
+    mw = types.SimpleNamespace(
+        col=col,
+        addonManager=AddonManager(),
+        reviewer=types.SimpleNamespace(state="question", card=None, web=web),
+        taskman=TaskManager(),
+        subs2srs_context=Subs2srsContext(col),
+    )
+    filter_module = load_addon(mw)
+    # the other collection is already open, so it's handed to the add-on's manager directly
+    importlib.import_module(f"{PACKAGE}.gui").collection_manager._col = other_col
+    lookups = importlib.import_module(f"{PACKAGE}.copy_around")
+    if args.budget is not None:
+        filter_module.consts.CONFIG["filter_time_budget_ms"] = args.budget
+    print(f"time budget: {filter_module.consts.CONFIG['filter_time_budget_ms']} ms")
+
+    print(
+        f"{'scenario':<10} {'p50 ms':>8} {'p90 ms':>8} {'p99 ms':>8} {'max ms':>8} {'pending':>8} {'stored KiB':>11}"
+    )
+    for name in args.scenario or SCENARIOS:
+        qfmt = "{{Word}}"
+        afmt = "{{FrontSide}}<hr>%s%s" % (
+            FILTER.format(fields="Expression,Snapshot", options=SCENARIOS[name]),
+            FILTER.format(fields="Audio", options=SCENARIOS[name]),
+        )
+        set_vocab_templates(col, qfmt, afmt)
+        filter_module.RESULTS_STORE = type(filter_module.RESULTS_STORE)()
+        filter_module.start_sampling_session()
+        stored_before = deep_size(filter_module.RESULTS_STORE)
+        latencies = []
+        pending = 0
+        for card in cards:
+            note = card.note()
+            mw.reviewer.card = card
+            mw.reviewer.state = "question"
+            start = time.perf_counter()
+            pending += render_card(filter_module, card, note)
+            latencies.append((time.perf_counter() - start) * 1000)
+        # lookups that ran over the budget are left to finish before the next scenario
+        wait_for_lookups(lookups)
+        growth = deep_size(filter_module.RESULTS_STORE) - stored_before
+        print(
+            f"{name:<10} {statistics.median(latencies):>8.2f} {percentile(latencies, 0.9):>8.2f} "
+            f"{percentile(latencies, 0.99):>8.2f} {max(latencies):>8.2f} {pending:>8} {growth / 1024:>11.1f}"
+        )
+
+    col.close()
+    other_col.close()
+    del app
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+"""Measure how long the add-on takes to load when Anki starts.
+
+Run from the repository's root in an environment with the packages of requirements.txt installed:
+
+    python benchmarks/startup.py
+
+Each run imports the add-on in a fresh interpreter, after the Anki modules that are already loaded
+when add-ons are, so only the add-on's own import time is measured. The benchmark fails if modules
+that should only be imported on first use were loaded, or if the median import time exceeds --max-ms.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SRC_DIR = os.path.join(ROOT, "src")
+PACKAGE = "copy_around"
+# Modules that are only imported when the dialog is opened or the template filter is used
+DEFERRED_MODULES = [
+    "bake",
+    "bake_dialog",
+    "cli",
+    "copy_around",
+    "dialog",
+    "filter",
+    "forms.bake_qt5",
+    "forms.bake_qt6",
+    "forms.form_qt5",
+    "forms.form_qt6",
+    "fuzzy",
+    "planner",
+    "results_store",
+    "signatures",
+    "thumbnails",
+]
+# Modules that Anki has already imported when it loads add-ons
+ANKI_MODULES = [
+    "anki.collection",
+    "aqt",
+    "aqt.qt",
+    "aqt.main",
+    "aqt.browser.browser",
+    "aqt.browser.previewer",
+    "aqt.clayout",
+    "aqt.editor",
+    "aqt.mediasrv",
+    "aqt.notetypechooser",
+    "aqt.operations",
+    "aqt.reviewer",
+    "aqt.utils",
+    "aqt.webview",
+]
+
+# Imports the add-on the way Anki does, and prints the import times and the loaded modules
+RUN_SCRIPT = r"""
+import importlib
+import importlib.util
+import json
+import os
+import sys
+import time
+import types
+
+src_dir, package, anki_modules = sys.argv[1], sys.argv[2], json.loads(sys.argv[3])
+for name in anki_modules:
+    importlib.import_module(name)
+
+import aqt
+
+
+class AddonManager:
+    def getConfig(self, module):
+        with open(os.path.join(src_dir, "config.json"), encoding="utf-8") as file:
+            return json.load(file)
+
+    def setWebExports(self, module, pattern):
+        pass
+
+
+aqt.mw = types.SimpleNamespace(addonManager=AddonManager())
+spec = importlib.util.spec_from_file_location(
+    package, os.path.join(src_dir, "__init__.py"), submodule_search_locations=[src_dir]
+)
+addon = importlib.util.module_from_spec(spec)
+sys.modules[package] = addon
+start = time.perf_counter()
+spec.loader.exec_module(addon)
+startup = time.perf_counter() - start
+modules = sorted(name[len(package) + 1 :] for name in sys.modules if name.startswith(package + "."))
+# what the first card using the filter pays instead
+start = time.perf_counter()
+importlib.import_module(package + ".filter")
+first_use = time.perf_counter() - start
+print(json.dumps({"startup": startup, "first_use": first_use, "modules": modules}))
+"""
+
+
+def run_once() -> dict:
+    output = subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            RUN_SCRIPT,
+            SRC_DIR,
+            PACKAGE,
+            json.dumps(ANKI_MODULES),
+        ],
+        check=True,
+        capture_output=True,
+        text=True,
+        env={**os.environ, "QT_QPA_PLATFORM": "offscreen"},
+    ).stdout
+    return json.loads(output.splitlines()[-1])
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--runs", type=int, default=5, help="number of fresh interpreters to run"
+    )
+    parser.add_argument(
+        "--max-ms",
+        type=float,
+        default=50.0,
+        help="fail if the median startup import time exceeds this",
+    )
+    args = parser.parse_args()
+
+    results = [run_once() for _ in range(max(args.runs, 1))]
+    startup = [r["startup"] * 1000 for r in results]
+    first_use = [r["first_use"] * 1000 for r in results]
+    modules = results[0]["modules"]
+    print(
+        f"startup: median {statistics.median(startup):.1f}ms, min {min(startup):.1f}ms"
+    )
+    print(
+        f"first filter use: median {statistics.median(first_use):.1f}ms, min {min(first_use):.1f}ms"
+    )
+    print(f"modules loaded at startup: {', '.join(modules)}")
+
+    failed = False
+    eager = [name for name in DEFERRED_MODULES if name in modules]
+    if eager:
+        print(f"FAIL: imported at startup instead of on first use: {', '.join(eager)}")
+        failed = True
+    if statistics.median(startup) > args.max_ms:
+        print(f"FAIL: startup exceeds {args.max_ms:.1f}ms")
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+"""Baking writes the output of a template filter into a field of the notes,
+so that it's shown without running any lookups at review time, including on other devices."""
+
+import dataclasses
+from dataclasses import dataclass
+from typing import Callable, List, Optional, Sequence, Tuple
+
+from anki.collection import Collection
+from anki.notes import Note, NoteId
+
+from . import consts
+from .copy_around import (
+    CopyAroundRelated,
+    RelatedQuery,
+    copy_note_media,
+    format_related,
+    get_notetype_sources,
+    get_related_many,
+    get_search_text,
+)
+from .filter import FilterOptions, get_other_col, parse_filter_options
+from .signatures import SignatureStore, make_signature, targets_state
+
+# Number of notes looked up in a single scan and written at once
+BAKE_BATCH_SIZE = 50
+
+
+@dataclass
+class BakeJob:
+    """Options of baking a filter into a field."""
+
+    # the filter as written in a template, e.g. {{copyaround notetype=subs2srs leech_from=Snapshot:word}}
+    filter_text: str
+    target_field: str
+    # skip notes whose search text and searched notes didn't change since they were last baked
+    incremental: bool = True
+
+
+@dataclass
+class BakeStats:
+    processed: int = 0
+    skipped: int = 0
+    updated: int = 0
+    # signatures of the baked notes, to be saved once they're written
+    signatures: List[Tuple[NoteId, str]] = dataclasses.field(
+        default_factory=list, repr=False
+    )
+
+
+def parse_template_filter(filter_text: str) -> Tuple[str, str]:
+    """Return the name (including the options) and the field of a copyaround filter
+    written as in a template, with or without the enclosing braces."""
+    filter_text = filter_text.strip()
+    if filter_text.startswith("{{") and filter_text.endswith("}}"):
+        filter_text = filter_text[2:-2]
+    *filter_names, field_name = filter_text.split(":")
+    for filter_name in filter_names:
+        filter_name = filter_name.strip()
+        if filter_name.startswith(consts.FILTER_NAME):
+            return filter_name, field_name.strip()
+    raise ValueError(f"No {consts.FILTER_NAME} filter found in {filter_text!r}")
+
+
+def get_baked_content(
+    search_text: str, related: CopyAroundRelated, options: FilterOptions
+) -> str:
+    """Format the results of a filter to be stored in a field.
+    Media files are copied to the collection and referenced directly,
+    and nothing that relies on the add-on is included."""
+    related = dataclasses.replace(related, related_notes=dict(related.related_notes))
+    for nid, note in related.related_notes.items():
+        copy_note_media(note)
+        related.related_notes[nid] = dataclasses.replace(
+            note,
+            fields={
+                name: dataclasses.replace(field, processed_contents=field.raw_contents)
+                for name, field in note.fields.items()
+            },
+            subs2srs_text=note.raw_subs2srs_text,
+        )
+    return format_related(search_text, related, options.highlight, options.cloze)
+
+
+def get_job_key(job: BakeJob) -> str:
+    filter_name, field_name = parse_template_filter(job.filter_text)
+    return make_signature(filter_name, field_name, job.target_field)
+
+
+def get_signature(search_text: str, target: str, state: List) -> str:
+    """Return the signature of the inputs of baking into a note.
+    The contents of the target field are included so that notes edited by hand or reverted
+    by an undo since are baked again."""
+    return make_signature(search_text, state, target)
+
+
+def get_targets_state(col: Collection, options: FilterOptions) -> List:
+    # the results of a note only change with its search text or the searched notes
+    return targets_state(
+        col,
+        [source.mid for source in get_notetype_sources(col, options.notetype_name)],
+        options.deck,
+    )
+
+
+def bake_notes(
+    col: Collection,
+    nids: Sequence[NoteId],
+    job: BakeJob,
+    store: SignatureStore,
+    on_batch_done: Optional[Callable[[BakeStats], None]] = None,
+) -> BakeStats:
+    """Bake the filter of `job` into the given notes.
+    Notes are looked up and written in batches. The signature of each processed note is added to
+    the returned stats, which should be saved to `store` once the notes are written,
+    so that incremental runs only process notes that changed. Signatures are based on the
+    searched notes after the last batch, so that the bake's own writes don't invalidate them."""
+    filter_name, field_name = parse_template_filter(job.filter_text)
+    options = parse_filter_options(filter_name)
+    other_col = get_other_col(options)
+    target_col = other_col or col
+    stats = BakeStats()
+    sources = get_notetype_sources(target_col, options.notetype_name)
+    if not sources:
+        return stats
+    state = get_targets_state(target_col, options)
+    previous = store.get(get_job_key(job)) if job.incremental else {}
+    # search text and target field contents of each processed note
+    inputs: List[Tuple[NoteId, str, str]] = []
+    for start in range(0, len(nids), BAKE_BATCH_SIZE):
+        notes: List[Note] = []
+        for nid in nids[start : start + BAKE_BATCH_SIZE]:
+            note = col.get_note(nid)
+            stats.processed += 1
+            if field_name not in note or job.target_field not in note:
+                continue
+            search_text = get_search_text(note, field_name)
+            if previous.get(nid) == get_signature(
+                search_text, note[job.target_field], state
+            ):
+                inputs.append((nid, search_text, note[job.target_field]))
+                stats.skipped += 1
+                continue
+            notes.append(note)
+        if notes:
+            queries = [
+                RelatedQuery(
+                    field_name,
+                    options.search_in,
+                    options.leech_from,
+                    options.count,
+                    options.shuffle,
+                    options.subs2srs_info,
+                    options.match,
+                    options.order,
+                    dedupe=options.dedupe,
+                    fuzzy=options.fuzzy,
+                    deck=options.deck,
+                    tag=options.tag,
+                    exclude_tag=options.exclude_tag,
+                    note=note,
+                )
+                for note in notes
+            ]
+            # the whole batch is looked up with a single scan
+            results = get_related_many(
+                notes[0], options.notetype_name, queries, other_col, col=col
+            )
+            updated_notes = []
+            for note, (search_text, related) in zip(notes, results):
+                baked = get_baked_content(search_text, related, options)
+                if note[job.target_field] != baked:
+                    note[job.target_field] = baked
+                    updated_notes.append(note)
+                inputs.append((note.id, get_search_text(note, field_name), baked))
+            if updated_notes:
+                col.update_notes(updated_notes)
+                stats.updated += len(updated_notes)
+        if on_batch_done:
+            on_batch_done(stats)
+    state = get_targets_state(target_col, options)
+    stats.signatures = [
+        (nid, get_signature(search_text, target, state))
+        for nid, search_text, target in inputs
+    ]
+    return stats
@@ -0,0 +1,146 @@
+from typing import List
+
+from anki.collection import Collection, OpChanges, SearchNode
+from anki.notes import Note, NoteId
+from aqt import qtmajor
+from aqt.main import AnkiQt
+from aqt.operations import CollectionOp
+from aqt.qt import *
+from aqt.utils import showWarning, tooltip
+
+from . import consts
+from .bake import (
+    BakeJob,
+    BakeStats,
+    bake_notes,
+    get_job_key,
+    parse_template_filter,
+)
+from .filter import TEMPLATE_FILTER_RE
+from .gui import link_table_manager
+from .signatures import SignatureStore
+
+if qtmajor > 5:
+    from .forms.bake_qt6 import Ui_Dialog
+else:
+    from .forms.bake_qt5 import Ui_Dialog  # type: ignore
+
+PROGRESS_LABEL = "Baked {count} out of {total} note(s)"
+
+
+class BakeDialog(QDialog):
+    """Asks for a filter to bake into a field of the selected notes or the notes of a deck."""
+
+    def __init__(self, mw: AnkiQt, parent: QWidget, notes: List[Note]):
+        super().__init__(parent)
+        self.mw = mw
+        self.config = mw.addonManager.getConfig(__name__)
+        self.notes = notes
+        self.form = Ui_Dialog()
+        self.form.setupUi(self)
+        self.setWindowTitle(f"Bake {consts.ADDON_NAME} Filter")
+        self.fields: List[str] = []
+        filters: List[str] = []
+        for mid in dict.fromkeys(note.mid for note in notes):
+            notetype = self.mw.col.models.get(mid)
+            for field in self.mw.col.models.field_names(notetype):
+                if field not in self.fields:
+                    self.fields.append(field)
+            # offer the filters used in the notes' templates
+            for template in notetype["tmpls"]:
+                for match in TEMPLATE_FILTER_RE.finditer(
+                    template["qfmt"] + template["afmt"]
+                ):
+                    if consts.FILTER_NAME in match.group(1):
+                        filter_text = match.group(0)
+                        if filter_text not in filters:
+                            filters.append(filter_text)
+        self.form.filterComboBox.addItems(filters)
+        self.form.targetFieldComboBox.addItems(self.fields)
+        self.form.notesComboBox.addItem(f"Selected notes ({len(notes)})", "")
+        for deck in sorted(
+            d.name for d in self.mw.col.decks.all_names_and_ids(include_filtered=False)
+        ):
+            self.form.notesComboBox.addItem(f"Deck: {deck}", deck)
+        qconnect(self.form.bakeButton.clicked, self.on_bake)
+
+    def exec(self) -> int:
+        if self.config["bake_filter"]:
+            self.form.filterComboBox.setCurrentText(self.config["bake_filter"])
+        if self.config["bake_field"] in self.fields:
+            self.form.targetFieldComboBox.setCurrentText(self.config["bake_field"])
+        self.form.incrementalCheckBox.setChecked(self.config["bake_incremental"])
+        return super().exec()
+
+    def _get_nids(self) -> List[NoteId]:
+        deck = self.form.notesComboBox.currentData()
+        if deck:
+            return list(
+                self.mw.col.find_notes(
+                    self.mw.col.build_search_string(SearchNode(deck=deck))
+                )
+            )
+        return [note.id for note in self.notes]
+
+    def on_bake(self) -> None:
+        self.job = BakeJob(
+            filter_text=self.form.filterComboBox.currentText(),
+            target_field=self.form.targetFieldComboBox.currentText(),
+            incremental=self.form.incrementalCheckBox.isChecked(),
+        )
+        try:
+            parse_template_filter(self.job.filter_text)
+        except ValueError as exc:
+            showWarning(str(exc), parent=self, title=consts.ADDON_NAME)
+            return
+        self.nids = self._get_nids()
+
+        self.config["bake_filter"] = self.job.filter_text
+        self.config["bake_field"] = self.job.target_field
+        self.config["bake_incremental"] = self.job.incremental
+        self.mw.addonManager.writeConfig(__name__, self.config)
+        self.accept()
+
+
+def bake_in_background(
+    mw: AnkiQt, parent: QWidget, job: BakeJob, nids: List[NoteId]
+) -> None:
+    """Bake a filter into the given notes, writing each batch as it's done.
+    All writes are undone together."""
+    stats = BakeStats()
+
+    def on_batch_done(batch_stats: BakeStats) -> None:
+        mw.taskman.run_on_main(
+            lambda: mw.progress.update(
+                label=PROGRESS_LABEL.format(
+                    count=batch_stats.processed, total=len(nids)
+                ),
+                value=batch_stats.processed,
+                max=len(nids),
+            )
+        )
+
+    def op(col: Collection) -> OpChanges:
+        nonlocal stats
+        undo_entry = col.add_custom_undo_entry(f"Bake {consts.ADDON_NAME} Filter")
+        # signatures are kept in the add-on's sidecar database
+        store = SignatureStore(link_table_manager.path)
+        try:
+            stats = bake_notes(col, nids, job, store, on_batch_done)
+        finally:
+            store.close()
+        return col.merge_undo_entries(undo_entry)
+
+    def on_success(changes: OpChanges) -> None:
+        # only notes that were written can be skipped by the next run
+        store = SignatureStore(link_table_manager.path)
+        try:
+            store.put(get_job_key(job), stats.signatures)
+        finally:
+            store.close()
+        message = f"Baked {stats.updated} note(s)."
+        if stats.skipped:
+            message += f" Skipped {stats.skipped} unchanged note(s)."
+        tooltip(message, parent=parent)
+
+    CollectionOp(parent=parent, op=op).success(on_success).run_in_background()
@@ -1,6 +1,7 @@
 from typing import List
 
 import aqt
+from anki.collection import Collection, OpChanges
 from aqt.browser.browser import Browser
 from aqt.editor import Editor
 from aqt.gui_hooks import browser_menus_did_init, editor_did_init_buttons
@@ -9,37 +10,67 @@ from aqt.qt import *
 from aqt.utils import tooltip
 
 from . import consts
-from .dialog import CopyAroundDialog
 
 
-def on_bulk_updated_notes(browser: Browser, updated_count: int) -> None:
-    if updated_count:
-        tooltip(f"Updated {updated_count} note(s).", parent=browser)
+def on_bulk_updated_notes(
+    browser: Browser, updated_count: int, skipped_count: int = 0
+) -> None:
+    message = f"Updated {updated_count} note(s)." if updated_count else ""
+    if skipped_count:
+        message += f" Skipped {skipped_count} unchanged note(s)."
+    if message:
+        tooltip(message.strip(), parent=browser)
 
 
 def on_browser_action_triggered(browser: Browser) -> None:
+    # the dialog and the query engine are only imported on first use
+    from .dialog import CopyAroundDialog
+
     notes = [browser.mw.col.get_note(nid) for nid in browser.selected_notes()]
     dialog = CopyAroundDialog(browser.mw, browser, notes)
     if dialog.exec():
         updated_notes = dialog.updated_notes
-        CollectionOp(
-            parent=browser,
-            op=lambda col: col.update_notes(updated_notes),
-        ).success(
-            lambda out: on_bulk_updated_notes(browser, len(updated_notes)),
+
+        def op(col: Collection) -> OpChanges:
+            changes = col.update_notes(updated_notes)
+            # only notes that were written can be skipped by the next run
+            dialog.save_signatures(col)
+            return changes
+
+        CollectionOp(parent=browser, op=op).success(
+            lambda out: on_bulk_updated_notes(
+                browser, len(updated_notes), dialog.skipped_count
+            ),
         ).run_in_background()
 
 
+def on_bake_action_triggered(browser: Browser) -> None:
+    from .bake_dialog import BakeDialog, bake_in_background
+
+    notes = [browser.mw.col.get_note(nid) for nid in browser.selected_notes()]
+    if not notes:
+        tooltip("Please select the notes to bake into.", parent=browser)
+        return
+    dialog = BakeDialog(browser.mw, browser, notes)
+    if dialog.exec():
+        bake_in_background(browser.mw, browser, dialog.job, dialog.nids)
+
+
 def on_browser_menus_did_init(browser: Browser) -> None:
     config = aqt.mw.addonManager.getConfig(__name__)
     action = QAction(consts.ADDON_NAME, browser)
     action.setShortcut(config["browser_shortcut"])
     qconnect(action.triggered, lambda: on_browser_action_triggered(browser))
+    bake_action = QAction(f"Bake {consts.ADDON_NAME} Filter...", browser)
+    qconnect(bake_action.triggered, lambda: on_bake_action_triggered(browser))
     browser.form.menuEdit.addSeparator()
     browser.form.menuEdit.addAction(action)
+    browser.form.menuEdit.addAction(bake_action)
 
 
 def on_editor_button_clicked(editor: Editor) -> None:
+    from .dialog import CopyAroundDialog
+
     dialog = CopyAroundDialog(editor.mw, editor.parentWindow, [editor.note])
     if dialog.exec():
         editor.loadNoteKeepingFocus()
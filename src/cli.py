@@ -0,0 +1,391 @@
+"""Run the bulk copy of the add-on's dialog on a collection without Anki's GUI.
+
+Usage, from the folder containing the add-on:
+
+    python -m <add-on folder>.cli collection.anki2 --notetype subs2srs \\
+        --search-field word --copy-into text_vocal \\
+        --search-in Expression --copy-from Snapshot --copy-from Audio --limit 2
+
+.colpkg files are unpacked to a temporary folder and written to --output. They must use the format
+of Anki 2.1.49 and older (exported with "Support older Anki versions" in newer versions).
+Related notes are looked up by worker processes, each using its own snapshot of the collection
+(Anki opens collections exclusively and can't open them read-only), while updated notes are
+written in batches as they come in.
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from contextlib import closing
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Set, Tuple
+
+from anki.collection import Collection
+from anki.notes import NoteId
+
+from .copy_around import (
+    MATCH_EXACT,
+    MATCH_SUBSTRING,
+    RESULT_ORDERS,
+    get_related_content,
+)
+
+
+@dataclass
+class BulkJob:
+    """Options of the bulk copy, as chosen in the add-on's dialog."""
+
+    notetype: str
+    search_field: str
+    copy_into_field: str
+    search_in_field: str
+    copy_from_fields: List[str]
+    max_notes: int = -1
+    shuffle: bool = False
+    match: str = MATCH_SUBSTRING
+    order: str = ""
+    dedupe: bool = False
+    fuzzy: int = 0
+    deck: str = ""
+    tag: str = ""
+    exclude_tag: str = ""
+
+
+# collection snapshot opened by each worker process
+_worker_col: Optional[Collection] = None
+
+
+def _set_lang() -> None:
+    # stripping HTML uses translated strings
+    from anki.lang import set_lang
+
+    set_lang("en")
+
+
+def _init_worker(snapshot_path: str) -> None:
+    global _worker_col
+    _set_lang()
+    # the copy is removed with the snapshot's folder
+    folder = tempfile.mkdtemp(dir=os.path.dirname(snapshot_path))
+    path = os.path.join(folder, "collection.anki2")
+    shutil.copy(snapshot_path, path)
+    _worker_col = Collection(path)
+
+
+def _process_chunk(job: BulkJob, nids: List[NoteId]) -> List[Tuple[NoteId, str]]:
+    return process_notes(_worker_col, job, nids)
+
+
+def process_notes(
+    col: Collection, job: BulkJob, nids: List[NoteId]
+) -> List[Tuple[NoteId, str]]:
+    """Return the contents copied into each of the given notes that had related notes."""
+    copied_notes = []
+    for nid in nids:
+        note = col.get_note(nid)
+        copied, _ = get_related_content(
+            note,
+            job.notetype,
+            job.search_field,
+            job.search_in_field,
+            job.copy_from_fields,
+            job.max_notes,
+            job.shuffle,
+            match=job.match,
+            order=job.order,
+            col=col,
+            dedupe=job.dedupe,
+            fuzzy=job.fuzzy,
+            deck=job.deck,
+            tag=job.tag,
+            exclude_tag=job.exclude_tag,
+        )
+        if copied:
+            copied_notes.append((nid, copied))
+    return copied_notes
+
+
+def write_notes(
+    col: Collection, job: BulkJob, copied_notes: List[Tuple[NoteId, str]]
+) -> None:
+    notes = []
+    for nid, copied in copied_notes:
+        note = col.get_note(nid)
+        note[job.copy_into_field] = copied
+        notes.append(note)
+    if notes:
+        col.update_notes(notes)
+
+
+class Stats:
+    def __init__(self, total: int) -> None:
+        self.total = total
+        self.processed = 0
+        self.updated = 0
+        self.start = time.perf_counter()
+
+    @property
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.start
+
+    def line(self) -> str:
+        rate = self.processed / self.elapsed if self.elapsed else 0.0
+        return f"{self.processed}/{self.total} notes processed, {self.updated} updated, {rate:.1f} notes/s"
+
+
+def run_bulk(
+    col_path: str,
+    job: BulkJob,
+    search: str = "",
+    jobs: int = 1,
+    batch_size: int = 200,
+    quiet: bool = False,
+) -> Stats:
+    """Copy related contents into the notes of the collection at `col_path` matching `search`."""
+    snapshot_dir = tempfile.mkdtemp(prefix="copyaround-")
+    try:
+        # workers read from a snapshot, so all lookups see the notes as they were before the run,
+        # like in the dialog
+        snapshot_path = os.path.join(snapshot_dir, "collection.anki2")
+        shutil.copy(col_path, snapshot_path)
+        if os.path.exists(f"{col_path}-wal"):
+            shutil.copy(f"{col_path}-wal", f"{snapshot_path}-wal")
+            # fold the WAL into the snapshot, as workers only copy its main file
+            with closing(sqlite3.connect(snapshot_path)) as db:
+                db.execute("pragma journal_mode = delete")
+        col = Collection(col_path)
+        try:
+            query = f'"{job.search_field}:_*"'
+            if search:
+                query = f"({search}) {query}"
+            nids = list(col.find_notes(query))
+            stats = Stats(len(nids))
+            chunks = [nids[i : i + batch_size] for i in range(0, len(nids), batch_size)]
+            # each worker copies the snapshot, so no more are started than there are chunks
+            jobs = max(1, min(jobs, len(chunks)))
+            with ProcessPoolExecutor(
+                max_workers=jobs,
+                # forked workers would inherit the state of Anki's backend
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(snapshot_path,),
+            ) as executor:
+                pending: Set[Future] = set()
+                sizes: Dict[Future, int] = {}
+                for chunk in chunks:
+                    # bound the number of results held in memory
+                    if len(pending) >= jobs * 2:
+                        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                        _write_done(col, job, done, sizes, stats, quiet)
+                    fut = executor.submit(_process_chunk, job, chunk)
+                    sizes[fut] = len(chunk)
+                    pending.add(fut)
+                _write_done(col, job, pending, sizes, stats, quiet)
+        finally:
+            col.close()
+    finally:
+        shutil.rmtree(snapshot_dir, ignore_errors=True)
+    return stats
+
+
+def _write_done(
+    col: Collection,
+    job: BulkJob,
+    done: Set[Future],
+    sizes: Dict[Future, int],
+    stats: Stats,
+    quiet: bool,
+) -> None:
+    for fut in done:
+        copied_notes = fut.result()
+        write_notes(col, job, copied_notes)
+        stats.processed += sizes.pop(fut)
+        stats.updated += len(copied_notes)
+        if not quiet:
+            print(stats.line(), file=sys.stderr)
+
+
+def unpack_colpkg(path: str, folder: str) -> str:
+    """Extract the collection and media files of a .colpkg file to `folder`, like Anki 2.1.49 and older import it.
+    Returns the path of the collection."""
+    col_path = os.path.join(folder, "collection.anki2")
+    media_dir = os.path.join(folder, "collection.media")
+    os.makedirs(media_dir, exist_ok=True)
+    with zipfile.ZipFile(path) as package:
+        names = set(package.namelist())
+        if "collection.anki21b" in names:
+            raise ValueError(
+                f'{path} uses the format of Anki 2.1.50+, export it with "Support older Anki versions" instead'
+            )
+        # packages of the V2 scheduler include a dummy collection.anki2 for older versions
+        name = (
+            "collection.anki21" if "collection.anki21" in names else "collection.anki2"
+        )
+        with package.open(name) as src, open(col_path, "wb") as dst:
+            shutil.copyfileobj(src, dst)
+        media = json.loads(package.read("media")) if "media" in names else {}
+        for index, filename in media.items():
+            if os.path.basename(filename) != filename:
+                continue
+            with package.open(index) as src, open(
+                os.path.join(media_dir, filename), "wb"
+            ) as dst:
+                shutil.copyfileobj(src, dst)
+    return col_path
+
+
+def pack_colpkg(col_path: str, out_path: str) -> None:
+    from anki.exporting import AnkiCollectionPackageExporter
+
+    col = Collection(col_path)
+    # the exporter closes the collection
+    AnkiCollectionPackageExporter(col).exportInto(os.path.abspath(out_path))
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog="copyaround",
+        description="Copy contents from related notes into notes of a collection.",
+    )
+    parser.add_argument("collection", help="path to a .anki2 or .colpkg file")
+    parser.add_argument(
+        "--notetype",
+        required=True,
+        help="notetype to copy contents from, or a comma-separated list of notetypes with optional field aliases",
+    )
+    parser.add_argument(
+        "--search-field", required=True, help="field of the notes to search for"
+    )
+    parser.add_argument(
+        "--copy-into", required=True, help="field of the notes to copy contents into"
+    )
+    parser.add_argument(
+        "--search-in",
+        default="",
+        help="field of the related notes to search in (all fields by default)",
+    )
+    parser.add_argument(
+        "--copy-from",
+        action="append",
+        required=True,
+        help="field of the related notes to copy (can be repeated)",
+    )
+    parser.add_argument(
+        "--limit", type=int, default=-1, help="maximum number of related notes"
+    )
+    parser.add_argument(
+        "--shuffle", action="store_true", help="randomize the related notes"
+    )
+    parser.add_argument(
+        "--exact",
+        action="store_true",
+        help="only match related notes whose field equals the search text",
+    )
+    parser.add_argument(
+        "--dedupe",
+        action="store_true",
+        help="skip related notes with the same contents as another one",
+    )
+    parser.add_argument(
+        "--fuzzy",
+        type=int,
+        default=0,
+        metavar="N",
+        help="match related notes containing a word within N edits of the search text",
+    )
+    parser.add_argument(
+        "--deck",
+        default="",
+        help="only search related notes with cards in this deck or its subdecks",
+    )
+    parser.add_argument(
+        "--tag",
+        default="",
+        help="only search related notes with any of these comma-separated tags",
+    )
+    parser.add_argument(
+        "--exclude-tag",
+        default="",
+        help="skip related notes with any of these comma-separated tags",
+    )
+    parser.add_argument(
+        "--order", choices=list(RESULT_ORDERS), default="", help="order of results"
+    )
+    parser.add_argument(
+        "--notes", default="", help="Anki search limiting the notes to update"
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="number of worker processes",
+    )
+    parser.add_argument(
+        "--batch-size", type=int, default=200, help="number of notes per write"
+    )
+    parser.add_argument(
+        "--output",
+        help="where to write the updated .colpkg file (required for .colpkg input)",
+    )
+    parser.add_argument(
+        "--quiet", action="store_true", help="only print the final stats"
+    )
+    args = parser.parse_args(argv)
+    if args.collection.endswith(".colpkg") and not args.output:
+        parser.error("--output is required for .colpkg files")
+    return args
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    args = parse_args(argv)
+    _set_lang()
+    job = BulkJob(
+        notetype=args.notetype,
+        search_field=args.search_field,
+        copy_into_field=args.copy_into,
+        search_in_field=args.search_in,
+        copy_from_fields=args.copy_from,
+        max_notes=args.limit,
+        shuffle=args.shuffle,
+        match=MATCH_EXACT if args.exact else MATCH_SUBSTRING,
+        order=args.order,
+        dedupe=args.dedupe,
+        fuzzy=args.fuzzy,
+        deck=args.deck,
+        tag=args.tag,
+        exclude_tag=args.exclude_tag,
+    )
+    folder = None
+    col_path = args.collection
+    if col_path.endswith(".colpkg"):
+        folder = tempfile.mkdtemp(prefix="copyaround-")
+        try:
+            col_path = unpack_colpkg(col_path, folder)
+        except ValueError as exc:
+            shutil.rmtree(folder, ignore_errors=True)
+            sys.exit(f"copyaround: {exc}")
+    try:
+        stats = run_bulk(
+            col_path, job, args.notes, max(args.jobs, 1), args.batch_size, args.quiet
+        )
+        if folder:
+            pack_colpkg(col_path, args.output)
+    finally:
+        if folder:
+            shutil.rmtree(folder, ignore_errors=True)
+    print(
+        f"Updated {stats.updated} of {stats.total} note(s) in {stats.elapsed:.2f}s "
+        f"({stats.total / stats.elapsed if stats.elapsed else 0.0:.1f} notes/s)"
+    )
+
+
+if __name__ == "__main__":
+    main()
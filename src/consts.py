@@ -1,10 +1,15 @@
 import os
 
-from aqt import mw
+try:
+    from aqt import mw
+except ImportError:
+    mw = None
 
 ADDON_NAME = "Copy Around"
 ADDON_DIR = os.path.dirname(__file__)
 ADDON_PACKAGE = os.path.basename(ADDON_DIR)
 ICONS_DIR = os.path.join(ADDON_DIR, "icons")
+USER_FILES_DIR = os.path.join(ADDON_DIR, "user_files")
 FILTER_NAME = "copyaround"
-CONFIG = mw.addonManager.getConfig(__name__)
+# empty when the add-on is used outside of Anki, e.g. by the command-line runner
+CONFIG = mw.addonManager.getConfig(__name__) if mw else {}
@@ -1,25 +1,72 @@
+import dataclasses
+import heapq
 import os
 import random
 import re
 import shutil
+import threading
 import unicodedata
-from dataclasses import dataclass
-from typing import Any, Dict, List, Match, MutableSequence, Optional, Tuple, Union, cast
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    Dict,
+    List,
+    Match,
+    MutableSequence,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+    cast,
+)
 
 from anki.cards import Card
 from anki.collection import Collection, SearchNode
 from anki.notes import Note, NoteId
-from aqt import mw
+from anki.utils import ids2str
+
+try:
+    from aqt import mw
+except ImportError:
+    # used without the GUI, e.g. by the command-line runner
+    mw = None
 
 try:
     from anki.utils import strip_html as stripHTML
 except ImportError:
-    from anki.utils import stripHTML
+    from anki.utils import stripHTML  # type: ignore
+try:
+    from anki.utils import field_checksum
+except ImportError:
+    from anki.utils import fieldChecksum as field_checksum  # type: ignore
 
 from . import consts
+from .fuzzy import FuzzyIndexes
+from .materialized import LinkSpec, LinkTable
+from .other_media import rewrite_other_media, serves_other_media
+from .planner import STRATEGY_REFUSE, STRATEGY_SAMPLED, QueryPlanner
+
+if TYPE_CHECKING:
+    from .thumbnails import ThumbnailCache
 
 CLOZE_HTML = """<span class="cloze" data-text={text} onmouseover="this.textContent = this.dataset.text;" onmouseout="this.textContent = '[...]';">[...]</span>"""
 HIGHLIGHT_COLOR = "#0000ff"
+# match target notes containing the search text
+MATCH_SUBSTRING = "substring"
+# match target notes whose field equals the search text
+MATCH_EXACT = "exact"
+# orders of results
+ORDER_SHORTEST = "shortest"
+ORDER_POSITION = "position"
+ORDER_DENSITY = "density"
+ORDER_RECENT = "recent"
+# number of rows fetched at a time when scanning for matches
+SCAN_PAGE_SIZE = 500
+# number of threads running lookups started by get_related_async() and get_related_many_async()
+LOOKUP_THREADS = 2
 # Credit: adapted from  https://icons.getbootstrap.com/icons/plus-circle/
 ADD_BUTTON = """<svg xmlns="http://www.w3.org/2000/svg" width="32" height="32" fill="#414141" class="bi bi-plus-circle" viewBox="0 0 16 16">
   <path d="M8 15A7 7 0 1 1 8 1a7 7 0 0 1 0 14zm0 1A8 8 0 1 0 8 0a8 8 0 0 0 0 16z"/>
@@ -49,12 +96,22 @@ class RelatedNote:
     fields: Dict[str, RelatedField]
     subs2srs_text: str
     raw_subs2srs_text: str
+    # media folder of the other collection the note's files are served from,
+    # if they were not copied to the current collection
+    media_dir: str = ""
+    media_files: List[str] = field(default_factory=list)
+
+
+# Keyset position of a result: its score in the order of results and its note ID
+Cursor = Tuple[float, NoteId]
 
 
 @dataclass
 class CopyAroundRelated:
     nid: NoteId
     related_notes: Dict[NoteId, RelatedNote]
+    # where the next page of results starts if the results filled a page
+    cursor: Optional[Cursor] = None
 
 
 @dataclass
@@ -89,16 +146,20 @@ SQL_RE = re.compile(r"[\\%_]")
 
 
 def escape_sql_wildcards(txt: str) -> str:
-    return SQL_RE.sub(r"\\\0", txt)
+    return SQL_RE.sub(r"\\\g<0>", txt)
 
 
-def copy_to_current_col(other_col: Collection, filename: str):
+def copy_to_current_col(other_col: Collection, filename: str) -> None:
+    copy_media_to_current_col(other_col.media.dir(), filename)
+
+
+def copy_media_to_current_col(media_dir: str, filename: str) -> None:
     dest_file = os.path.join(mw.col.media.dir(), filename)
     if not os.path.exists(dest_file):
         try:
             shutil.copy(
                 os.path.join(
-                    other_col.media.dir(),
+                    media_dir,
                     filename,
                 ),
                 dest_file,
@@ -107,6 +168,836 @@ def copy_to_current_col(other_col: Collection, filename: str):
             pass
 
 
+@dataclass
+class RelatedQuery:
+    """Options of a single lookup done by get_related_many()."""
+
+    search_field: str
+    search_in_field: str
+    copy_from_fields: List[str]
+    max_notes: int = -1
+    shuffle: bool = False
+    subs2srs_info: Optional[Subs2srsOptions] = None
+    match: str = MATCH_SUBSTRING
+    # one of the ORDER_* constants; takes precedence over shuffle
+    order: str = ""
+    # seed used to sample results when shuffling
+    seed: Optional[int] = None
+    # if set, only these notes are fetched, in this order, instead of searching
+    nids: Optional[List[NoteId]] = None
+    # if set, only results ordered after this cursor are returned
+    after: Optional[Cursor] = None
+    # skip results with the same contents as a better one
+    dedupe: bool = False
+    # if positive, match notes containing a word within this number of edits of the search text
+    fuzzy: int = 0
+    # only match notes with cards in this deck or its children
+    deck: str = ""
+    # comma-separated tags; only match notes having any of them (or their child tags)
+    tag: str = ""
+    # comma-separated tags; skip notes having any of them (or their child tags)
+    exclude_tag: str = ""
+    # the note to search for, if not the one passed to get_related_many()
+    note: Optional[Note] = None
+
+
+HTML_TAG_RE = re.compile(r"<[^>]*>")
+
+
+def _score_shortest(nid: NoteId, text: str, search_text: str) -> float:
+    return len(text)
+
+
+def _score_position(nid: NoteId, text: str, search_text: str) -> float:
+    pos = text.lower().find(search_text.lower())
+    return pos if pos >= 0 else len(text)
+
+
+def _score_density(nid: NoteId, text: str, search_text: str) -> float:
+    if not text or not search_text:
+        return 0
+    return -text.lower().count(search_text.lower()) * len(search_text) / len(text)
+
+
+def _score_recent(nid: NoteId, text: str, search_text: str) -> float:
+    return -nid
+
+
+# Scores of the supported result orders. Lower scores come first.
+RESULT_ORDERS: Dict[str, Callable[[NoteId, str, str], float]] = {
+    ORDER_SHORTEST: _score_shortest,
+    ORDER_POSITION: _score_position,
+    ORDER_DENSITY: _score_density,
+    ORDER_RECENT: _score_recent,
+}
+
+
+def _seeded_key(seed: int, nid: NoteId) -> int:
+    return hash((seed, nid))
+
+
+SOUND_TAG_RE = re.compile(r"\[sound:[^\]]*\]")
+WHITESPACE_RE = re.compile(r"\s+")
+
+
+def _dedupe_key(dest_note: Dict[str, str]) -> str:
+    """Return the normalized text of a candidate's fields, ignoring markup and media,
+    so that the same sentence found in several notes is only shown once."""
+    texts = []
+    for contents in dest_note.values():
+        text = stripHTML(SOUND_TAG_RE.sub("", contents))
+        texts.append(
+            WHITESPACE_RE.sub(" ", unicodedata.normalize("NFC", text)).strip().lower()
+        )
+    if not any(texts):
+        # media-only fields are compared as is
+        return "\x1f".join(dest_note.values())
+    return "\x1f".join(texts)
+
+
+class ResultCollector:
+    """Selects the rows of a query while streaming over its candidates.
+
+    When results are ordered or shuffled, a bounded heap keeps only the best `max_notes` rows,
+    so memory use doesn't depend on the number of matched notes.
+    Shuffling orders rows by a key derived from `seed` and the note ID,
+    which samples the same notes for the same seed.
+    Rows are ordered by their score then note ID, which is what cursors point into.
+    With `dedupe`, only the best row of candidates with the same contents is kept.
+    """
+
+    def __init__(
+        self,
+        max_notes: int = -1,
+        shuffle: bool = False,
+        order: str = "",
+        search_text: str = "",
+        seed: Optional[int] = None,
+        nids: Optional[List[NoteId]] = None,
+        after: Optional[Cursor] = None,
+        dedupe: bool = False,
+    ) -> None:
+        self.max_notes = max_notes
+        self.search_text = search_text
+        self.after = after
+        self.dedupe = dedupe
+        # kept rows by their dedupe key
+        self.kept: Dict[str, Any] = {}
+        # the order of results that cursors refer to
+        self.key: Optional[Callable[[NoteId, str, str], float]] = None
+        if order:
+            self.key = RESULT_ORDERS.get(order)
+        elif shuffle:
+            if seed is None:
+                seed = random.getrandbits(64)
+            self.key = lambda nid, text, search_text: _seeded_key(seed, nid)
+        self.score = self.key
+        if nids is not None:
+            positions = {nid: i for i, nid in enumerate(nids)}
+            self.score = lambda nid, text, search_text: positions[nid]
+        # heap of (-score, -nid, nid, dest_note, cursor, dedupe key) when ordering, (nid, dest_note, cursor) otherwise
+        self.rows: List[Any] = []
+
+    @property
+    def done(self) -> bool:
+        """Whether further candidates can't change the results."""
+        return not self.score and 0 <= self.max_notes <= len(self.rows)
+
+    def add(self, nid: NoteId, dest_note: Dict[str, str], text: str) -> None:
+        if self.done:
+            return
+        text = HTML_TAG_RE.sub("", text) if self.score else text
+        cursor = (self.key(nid, text, self.search_text) if self.key else 0, nid)
+        if self.after and cursor <= tuple(self.after):
+            return
+        dedupe_key = _dedupe_key(dest_note) if self.dedupe else None
+        if not self.score:
+            if dedupe_key is not None:
+                if dedupe_key in self.kept:
+                    return
+                self.kept[dedupe_key] = nid
+            self.rows.append((nid, dest_note, cursor))
+            return
+        if self.score is self.key:
+            score = cursor[0]
+        else:
+            score = self.score(nid, text, self.search_text)
+        entry = (-score, -nid, nid, dest_note, cursor, dedupe_key)
+        if dedupe_key is not None:
+            kept = self.kept.get(dedupe_key)
+            if kept:
+                if entry[:2] < kept[:2]:
+                    return
+                # replace the duplicate with this better row
+                self.rows.remove(kept)
+                heapq.heapify(self.rows)
+            self.kept[dedupe_key] = entry
+        if self.max_notes < 0 or len(self.rows) < self.max_notes:
+            heapq.heappush(self.rows, entry)
+        elif self.max_notes > 0:
+            # drops the worst of the kept rows (the highest note ID among equal scores)
+            dropped = heapq.heappushpop(self.rows, entry)
+            if dropped[5] is not None and self.kept.get(dropped[5]) is dropped:
+                del self.kept[dropped[5]]
+
+    def _sorted_rows(self) -> List[Tuple[NoteId, Dict[str, str], Cursor]]:
+        if self.score:
+            return [row[2:5] for row in sorted(self.rows, reverse=True)]
+        return self.rows
+
+    def results(self) -> List[Tuple[NoteId, Dict[str, str]]]:
+        return [(nid, dest_note) for nid, dest_note, _ in self._sorted_rows()]
+
+    def cursor(self) -> Optional[Cursor]:
+        """Return the cursor of the next page if the results filled a page."""
+        if self.max_notes <= 0 or len(self.rows) < self.max_notes:
+            return None
+        return self._sorted_rows()[-1][2]
+
+
+def get_search_text(note: Note, search_field: str) -> str:
+    search_text = stripHTML(note[search_field])
+    return unicodedata.normalize("NFC", search_text)
+
+
+def build_related_note(
+    col: Collection,
+    mid: int,
+    nid: NoteId,
+    dest_note: Dict[str, str],
+    copy_from_fields: List[str],
+    subs2srs_info: Optional[Subs2srsOptions] = None,
+    other_col: Optional[Collection] = None,
+) -> Optional[RelatedNote]:
+    copied_fields = {}
+    subs2srs_text = ""
+    raw_subs2srs_text = ""
+    media_dir = ""
+    media_files: List[str] = []
+    serve_media = other_col and serves_other_media()
+    if serve_media:
+        media_dir = col.media.dir()
+    for copy_from_field in copy_from_fields:
+        if copy_from_field in dest_note:
+            contents = dest_note[copy_from_field]
+            processed_contents = contents
+            if other_col:
+                filenames = col.media.filesInStr(mid, contents)
+                if serve_media:
+                    # files are only copied when the note is saved
+                    media_files.extend(filenames)
+                    processed_contents = rewrite_other_media(contents, media_dir)
+                else:
+                    # UGLY HACK: copy media files from the other collection to the current collection
+                    # FIXME: find a better way to do this
+                    for filename in filenames:
+                        copy_to_current_col(col, filename)
+            copied_fields[copy_from_field] = RelatedField(
+                copy_from_field, contents, processed_contents
+            )
+    if subs2srs_info and (subs2srs_context := getattr(mw, "subs2srs_context", None)):
+        # get info from previous and next sub2srs notes using the subs2srs-context add-on
+        # TODO: maybe factor out some of this logic to subs2srs-context
+        audio_buttons = subs2srs_context.get_audio_buttons(nid, flip=True, col=col)
+        audio_filenames = [
+            subs2srs_context.get_audio_filename(nid - 1, col=col),
+            subs2srs_context.get_audio_filename(nid + 1, col=col),
+        ]
+        for filename in audio_filenames:
+            copy_to_current_col(col, filename)
+        audio_tags = [
+            f"[sound:{filename}]" if filename else "" for filename in audio_filenames
+        ]
+        expressions = subs2srs_context.get_expressions(nid, col=col)
+        subs2srs_text += f'<div class="copyaround-subs2srs-context" style="font-size: {subs2srs_info.font_size};">{expressions[0]}{audio_buttons[0]}{audio_buttons[1]}{expressions[1]}</div>'
+        if subs2srs_info.save:
+            raw_subs2srs_text += f'<div class="copyaround-subs2srs-context" style="font-size: {subs2srs_info.font_size};">{expressions[0]}{audio_tags[0]}{audio_tags[1]}{expressions[1]}</div>'
+
+    if copied_fields:
+        return RelatedNote(
+            nid,
+            copied_fields,
+            subs2srs_text,
+            raw_subs2srs_text,
+            media_dir,
+            media_files,
+        )
+    return None
+
+
+@dataclass
+class _Matcher:
+    """The SQL condition of a single query in get_related_many()."""
+
+    index: int
+    leech_fields: List[str]
+    condition: str
+    params: List[Any]
+    # search text in the form compared against target notes
+    pattern: str
+    # exact matches are verified against the stripped contents of this field (all fields if empty)
+    verify_field: Optional[str] = None
+    # whether the condition is an index lookup that should not be merged into a scan
+    seek: bool = False
+    # field whose text is scored when ordering results (the leech fields if empty)
+    score_field: str = ""
+    # number of rows of the first page of the scan (SCAN_PAGE_SIZE if 0)
+    page_size: int = 0
+    # maximum number of candidates of a sampled scan (all candidates if 0)
+    max_rows: int = 0
+    # note IDs after which the ranges of a sampled scan start, wrapping around to the first notes
+    sample_starts: List[int] = field(default_factory=list)
+    # whether the condition limits the candidates to a deck or tags
+    scoped: bool = False
+
+
+def _sample_starts(
+    col: Collection, mids: Sequence[int], seed: Optional[int], count: int
+) -> List[int]:
+    """Return the sorted note IDs after which the ranges of a sampled scan of shuffled results start.
+    Ranges start right before random notes of the notetypes rather than at random IDs,
+    which are creation times clustered around the times notes were added.
+    The same seed picks the same notes, so that the same notes are sampled."""
+    total = col.db.scalar(f"select count() from notes where mid in {ids2str(mids)}")
+    if not total:
+        return [0]
+    offsets = sorted(random.Random(seed).sample(range(total), min(count, total)))
+    return [
+        col.db.scalar(
+            f"select id from notes where mid in {ids2str(mids)} order by id limit 1 offset ?",
+            offset,
+        )
+        - 1
+        for offset in offsets
+    ]
+
+
+def is_exact_match(text: str, search_text: str) -> bool:
+    return unicodedata.normalize("NFC", stripHTML(text)) == search_text
+
+
+_planner = QueryPlanner()
+_fuzzy_indexes = FuzzyIndexes()
+
+# e.g. Mining(Expression=Sentence;Snapshot=Picture)
+NOTETYPE_ALIASES_RE = re.compile(
+    r"^(?P<name>.+?)\s*(?:\((?P<aliases>[^()]*=[^()]*)\))?$"
+)
+
+
+@dataclass
+class NotetypeSource:
+    """A notetype searched by a lookup, with the ordinals of its fields
+    by the field names used in the lookup."""
+
+    mid: int
+    field_ords: Dict[str, int]
+
+
+def parse_notetype_names(notetype_name: str) -> List[Tuple[str, Dict[str, str]]]:
+    """Parse a comma-separated list of notetype names, each optionally followed by field aliases,
+    e.g. `subs2srs,Mining(Expression=Sentence;Snapshot=Picture)`.
+    Returns the name and aliases of each notetype. Aliases map field names used in lookups
+    to the notetype's own field names."""
+    notetypes = []
+    for entry in re.split(r",(?![^(]*\))", notetype_name):
+        match = NOTETYPE_ALIASES_RE.match(entry.strip())
+        if not match:
+            continue
+        aliases = {}
+        for pair in (match.group("aliases") or "").split(";"):
+            alias, sep, field_name = pair.partition("=")
+            if sep:
+                aliases[alias.strip()] = field_name.strip()
+        notetypes.append((match.group("name"), aliases))
+    return notetypes
+
+
+def get_notetype_sources(col: Collection, notetype_name: str) -> List[NotetypeSource]:
+    """Return the notetypes named by `notetype_name`, which is either the name of a notetype
+    or a list parsed by parse_notetype_names()."""
+    notetype = col.models.by_name(notetype_name)
+    if notetype:
+        return [
+            NotetypeSource(
+                notetype["id"], {f["name"]: f["ord"] for f in notetype["flds"]}
+            )
+        ]
+    sources = []
+    for name, aliases in parse_notetype_names(notetype_name):
+        notetype = col.models.by_name(name)
+        if not notetype:
+            continue
+        field_ords = {f["name"]: f["ord"] for f in notetype["flds"]}
+        for alias, field_name in aliases.items():
+            if field_name in field_ords:
+                field_ords[alias] = field_ords[field_name]
+        sources.append(NotetypeSource(notetype["id"], field_ords))
+    return sources
+
+
+class _SourceFields:
+    """Builds SQL expressions of fields of the notes of several notetypes."""
+
+    def __init__(self, sources: List[NotetypeSource]) -> None:
+        self.sources = sources
+        self.mids = [source.mid for source in sources]
+        # all field names, in order
+        self.names: List[str] = []
+        for source in sources:
+            for name in source.field_ords:
+                if name not in self.names:
+                    self.names.append(name)
+
+    def __contains__(self, name: str) -> bool:
+        return any(name in source.field_ords for source in self.sources)
+
+    def ords(self, name: str) -> List[int]:
+        return [
+            source.field_ords[name]
+            for source in self.sources
+            if name in source.field_ords
+        ]
+
+    def sql(self, name: str) -> Tuple[str, List[Any]]:
+        """Return an expression of the contents of a field, empty for notetypes without it."""
+        if len(self.sources) == 1:
+            return "field_at_index(n.flds, ?)", [self.sources[0].field_ords[name]]
+        params: List[Any] = []
+        cases = []
+        for source in self.sources:
+            if name in source.field_ords:
+                cases.append("when ? then field_at_index(n.flds, ?)")
+                params.extend((source.mid, source.field_ords[name]))
+        return f"(case n.mid {' '.join(cases)} else '' end)", params
+
+
+TAG_CONDITION = "(n.tags like ? escape '\\' or n.tags like ? escape '\\')"
+
+
+def _tag_params(tag: str) -> List[str]:
+    # tags are stored space-separated with a leading and a trailing space
+    pattern = escape_sql_wildcards(tag).replace("*", "%")
+    return [f"% {pattern} %", f"% {pattern}::%"]
+
+
+def get_scope_condition(
+    col: Collection, deck: str, tag: str, exclude_tag: str
+) -> Optional[Tuple[str, List[Any]]]:
+    """Return the SQL condition limiting a lookup to notes with cards in `deck` (or its children)
+    that have any of the comma-separated tags in `tag` and none of the ones in `exclude_tag`.
+    Returns None if the deck doesn't exist."""
+    conditions = []
+    params: List[Any] = []
+    if deck:
+        did = col.decks.id_for_name(deck)
+        if not did:
+            return None
+        dids = ids2str(col.decks.deck_and_child_ids(did))
+        # cards moved to filtered decks still belong to their original deck
+        filtered_dids = ids2str(
+            {d.id for d in col.decks.all_names_and_ids(include_filtered=True)}
+            - {d.id for d in col.decks.all_names_and_ids(include_filtered=False)}
+        )
+        # both alternatives can use the index on the cards' deck
+        conditions.append(
+            f"n.id in (select c.nid from cards c where c.did in {dids} or (c.did in {filtered_dids} and c.odid in {dids}))"
+        )
+    tags = [t.strip() for t in tag.split(",") if t.strip()]
+    if tags:
+        conditions.append(f'({" or ".join(TAG_CONDITION for _ in tags)})')
+        for t in tags:
+            params.extend(_tag_params(t))
+    for t in (t.strip() for t in exclude_tag.split(",") if t.strip()):
+        conditions.append(f"not {TAG_CONDITION}")
+        params.extend(_tag_params(t))
+    return " and ".join(conditions), params
+
+
+def _build_matcher(
+    col: Collection,
+    fields: _SourceFields,
+    index: int,
+    query: RelatedQuery,
+    note: Note,
+    search_text: str,
+    columns: List[str],
+) -> Optional[_Matcher]:
+    """Return the SQL condition of a query of get_related_many() searching for `note`,
+    or None if it can't match anything. Fields it needs are added to `columns`."""
+    sources = fields.sources
+    mids = fields.mids
+    if query.search_in_field and query.search_in_field not in fields:
+        return None
+    leech_fields = [f for f in query.copy_from_fields if f in fields]
+    if not leech_fields:
+        # no requested fields exist in target notetype
+        return None
+    index_lookup = (
+        query.match == MATCH_EXACT
+        and query.search_in_field
+        and set(fields.ords(query.search_in_field)) == {0}
+        and all(query.search_in_field in s.field_ords for s in sources)
+    )
+    plan = None
+    if query.nids is None:
+        plan = _planner.plan(
+            col,
+            mids,
+            search_text,
+            query.max_notes,
+            ranked=bool(query.order or query.shuffle),
+            index=index_lookup or query.fuzzy > 0,
+            exact=query.match == MATCH_EXACT,
+            shuffled=query.shuffle and not query.order,
+        )
+        if plan.strategy == STRATEGY_REFUSE:
+            # the search text would match nearly every note
+            return None
+    scope = get_scope_condition(col, query.deck, query.tag, query.exclude_tag)
+    if scope is None:
+        return None
+    escaped_search = to_sql(search_text)
+    matcher = _Matcher(index, leech_fields, "", [], escaped_search)
+    if plan:
+        matcher.page_size = plan.page_size
+        if (
+            plan.strategy == STRATEGY_SAMPLED
+            and not query.after
+            and consts.CONFIG.get("sample_large_lookups", True)
+        ):
+            matcher.max_rows = plan.max_rows
+            matcher.sample_starts = _sample_starts(col, mids, query.seed, plan.ranges)
+    if query.nids is not None:
+        # notes that were already matched before
+        matcher.condition = f"n.id in {ids2str(query.nids)}"
+        matcher.seek = True
+    elif query.fuzzy > 0:
+        fuzzy_nids = [
+            nid
+            for source in sources
+            if not query.search_in_field or query.search_in_field in source.field_ords
+            for nid in _fuzzy_indexes.search(
+                col,
+                source.mid,
+                source.field_ords[query.search_in_field]
+                if query.search_in_field
+                else -1,
+                search_text,
+                query.fuzzy,
+            )
+        ]
+        if not fuzzy_nids:
+            return None
+        matcher.condition = f"n.id in {ids2str(fuzzy_nids)}"
+        matcher.seek = True
+    elif index_lookup:
+        # use the index on the first field's checksum
+        matcher.condition = "n.csum = ?"
+        matcher.params.append(field_checksum(search_text))
+        matcher.seek = True
+    elif query.search_in_field:
+        field_sql, field_sql_params = fields.sql(query.search_in_field)
+        matcher.condition = f"{field_sql} like '%' || ? || '%' escape '\\'"
+        matcher.params.extend(field_sql_params)
+        matcher.params.append(escaped_search)
+    else:
+        matcher.condition = "(n.sfld like '%' || ? || '%' escape '\\' or n.flds like '%' || ? || '%' escape '\\')"
+        matcher.params.append(escaped_search)
+        matcher.params.append(escaped_search)
+    if query.match == MATCH_EXACT and query.nids is None and not query.fuzzy:
+        matcher.pattern = search_text
+        matcher.verify_field = query.search_in_field
+        for name in [query.search_in_field] if query.search_in_field else fields.names:
+            if name not in columns:
+                columns.append(name)
+    if query.order and query.search_in_field:
+        matcher.score_field = query.search_in_field
+        if query.search_in_field not in columns:
+            columns.append(query.search_in_field)
+    if scope[0]:
+        # narrow down the candidates before the more expensive field conditions
+        matcher.condition = f"{scope[0]} and {matcher.condition}"
+        matcher.params[:0] = scope[1]
+        matcher.scoped = True
+    matcher.condition += " and n.id != ?"
+    matcher.params.append(note.id)
+    if query.after and not (query.order or query.shuffle):
+        # results are in note ID order, so the next page starts right after the cursor
+        matcher.condition += " and n.id > ?"
+        matcher.params.append(query.after[1])
+    subqueries = []
+    for name in leech_fields:
+        field_sql, field_sql_params = fields.sql(name)
+        subqueries.append(f"{field_sql} != ''")
+        matcher.params.extend(field_sql_params)
+        if name not in columns:
+            columns.append(name)
+    matcher.condition += f' and ({" or ".join(subqueries)})'
+    return matcher
+
+
+def get_related_many(
+    note: Note,
+    notetype_name: str,
+    queries: List[RelatedQuery],
+    other_col: Optional[Collection] = None,
+    link_table: Optional[LinkTable] = None,
+    col: Optional[Collection] = None,
+) -> List[Tuple[str, CopyAroundRelated]]:
+    """Run several lookups against the same notetypes using a single scan of their notes.
+    Returns the search text and the related notes of each query, in order.
+    Queries can search for different notes, e.g. to look up a batch of notes at once.
+    `notetype_name` can also name several notetypes (see get_notetype_sources()).
+    `col` is the collection searched when `other_col` is not given, defaulting to the main window's one."""
+
+    results = [
+        ("", CopyAroundRelated((query.note or note).id, {})) for query in queries
+    ]
+    if other_col:
+        col = other_col
+    elif not col:
+        col = mw.col
+    sources = get_notetype_sources(col, notetype_name)
+    if not sources:
+        return results
+    fields = _SourceFields(sources)
+    mids = fields.mids
+
+    # fields fetched for any of the queries
+    columns: List[str] = []
+    matchers: List[_Matcher] = []
+    for i, query in enumerate(queries):
+        search_text = get_search_text(query.note or note, query.search_field)
+        results[i] = (search_text, results[i][1])
+        matcher = _build_matcher(
+            col, fields, i, query, query.note or note, search_text, columns
+        )
+        if matcher:
+            matchers.append(matcher)
+    if not matchers:
+        return results
+
+    mid_clause = (
+        "n.mid = ?" if len(mids) == 1 else f"n.mid in ({', '.join('?' for _ in mids)})"
+    )
+    field_subquery = ", ".join(fields.sql(name)[0] for name in columns)
+    field_params = [param for name in columns for param in fields.sql(name)[1]]
+    collectors = {
+        matcher.index: ResultCollector(
+            queries[matcher.index].max_notes,
+            queries[matcher.index].shuffle,
+            queries[matcher.index].order,
+            results[matcher.index][0],
+            queries[matcher.index].seed,
+            queries[matcher.index].nids,
+            queries[matcher.index].after,
+            queries[matcher.index].dedupe,
+        )
+        for matcher in matchers
+    }
+
+    def add_rows(
+        matcher: _Matcher,
+        rows: List[Any],
+        collectors: Dict[int, ResultCollector],
+    ) -> None:
+        collector = collectors[matcher.index]
+        for nid, *values in rows:
+            if collector.done:
+                return
+            if matcher.verify_field is not None:
+                verify_fields = (
+                    [matcher.verify_field] if matcher.verify_field else fields.names
+                )
+                if not any(
+                    is_exact_match(values[columns.index(name)], matcher.pattern)
+                    for name in verify_fields
+                ):
+                    continue
+            dest_note = {}
+            for name in matcher.leech_fields:
+                val = values[columns.index(name)]
+                if val:
+                    dest_note[name] = val
+            if matcher.score_field:
+                score_text = values[columns.index(matcher.score_field)]
+            else:
+                score_text = " ".join(dest_note.values())
+            collector.add(nid, dest_note, score_text)
+
+    def run_scan(
+        scan_matchers: List[_Matcher],
+        collectors: Dict[int, ResultCollector],
+        mid_clause: str = mid_clause,
+        start_nid: int = 0,
+        end_nid: Optional[int] = None,
+        max_rows: int = 0,
+    ) -> int:
+        """Scan the candidates with IDs in (start_nid, end_nid], stopping after `max_rows` of them if positive.
+        Returns the number of scanned candidates."""
+        flag_subquery = ", ".join(f"({m.condition})" for m in scan_matchers)
+        flag_params = [p for m in scan_matchers for p in m.params]
+        where_clause = " or ".join(f"({m.condition})" for m in scan_matchers)
+        # Candidates are paged by note ID so that only a page of rows is held in memory at once
+        # and the scan can stop early when no more rows are needed
+        end_clause = "" if end_nid is None else " and n.id <= ?"
+        end_params = [] if end_nid is None else [end_nid]
+        sql = f"select n.id, {field_subquery}, {flag_subquery} from notes n where {mid_clause} and n.id > ?{end_clause} and ({where_clause}) order by n.id limit ?"
+        # print(f"copyaround: {sql=} {other_col=}")
+        # Scans that can stop early start with small pages that grow as more rows are needed
+        page_size = min(
+            (m.page_size or SCAN_PAGE_SIZE for m in scan_matchers),
+            default=SCAN_PAGE_SIZE,
+        )
+        last_nid = start_nid
+        scanned = 0
+        while True:
+            limit = page_size
+            if max_rows > 0:
+                limit = min(limit, max_rows - scanned)
+            rows = col.db.all(
+                sql,
+                *field_params,
+                *flag_params,
+                *mids,
+                last_nid,
+                *end_params,
+                *flag_params,
+                limit,
+            )
+            scanned += len(rows)
+            for nid, *values in rows:
+                flags = values[len(columns) :]
+                for flag, matcher in zip(flags, scan_matchers):
+                    if flag:
+                        add_rows(matcher, [(nid, *values[: len(columns)])], collectors)
+            if (
+                len(rows) < limit
+                or 0 < max_rows <= scanned
+                or all(collectors[m.index].done for m in scan_matchers)
+            ):
+                break
+            last_nid = rows[-1][0]
+            page_size = min(page_size * 4, SCAN_PAGE_SIZE)
+        return scanned
+
+    def run_single(matcher: _Matcher) -> List[NoteId]:
+        matched = {matcher.index: ResultCollector()}
+        run_scan([matcher], matched)
+        return [nid for nid, _ in matched[matcher.index].results()]
+
+    # links are materialized for a single notetype
+    if link_table and len(sources) == 1:
+        field_ords = sources[0].field_ords
+        for matcher in matchers:
+            query = queries[matcher.index]
+            if query.fuzzy or query.nids is not None:
+                # fuzzy matches are already looked up in their own index,
+                # and the notes of a cached sample are fetched directly
+                run_scan([matcher], collectors, f"+{mid_clause}")
+                continue
+            if matcher.scoped:
+                # links are materialized for all notes of the notetype
+                run_scan([matcher], collectors)
+                continue
+            spec = LinkSpec(
+                dst_col=col.path,
+                dst_mid=mids[0],
+                search_in_ord=field_ords[query.search_in_field]
+                if query.search_in_field
+                else -1,
+                copy_from_ords=[field_ords[name] for name in matcher.leech_fields],
+                search_field=query.search_field,
+                exact=query.match == MATCH_EXACT,
+            )
+            source_note = query.note or note
+            page_size = matcher.page_size or SCAN_PAGE_SIZE
+            nids = link_table.related_nids(
+                col,
+                source_note,
+                matcher.pattern,
+                spec,
+                lambda: run_single(matcher),
+                page_size,
+            )
+            # only fetch the needed fields of the linked notes, a page at a time
+            # so that lookups needing a few of them stop early
+            while nids:
+                add_rows(
+                    matcher,
+                    col.db.all(
+                        f"select n.id, {field_subquery} from notes n where n.id in {ids2str(nids)} order by n.id",
+                        *field_params,
+                    ),
+                    collectors,
+                )
+                if len(nids) < page_size or collectors[matcher.index].done:
+                    break
+                page_size = min(page_size * 4, SCAN_PAGE_SIZE)
+                nids = link_table.links(spec, source_note.id, nids[-1], page_size)
+    else:
+        # index lookups are cheap on their own, while the other conditions share one scan
+        scan_matchers = [m for m in matchers if not m.seek and not m.max_rows]
+        if scan_matchers:
+            run_scan(scan_matchers, collectors)
+        for matcher in matchers:
+            if matcher.max_rows:
+                # only rank a sample of the candidates of terms that match too many notes,
+                # taken from each range in turn; rows a range lacks are taken from the next one
+                starts = matcher.sample_starts
+                per_range = max(1, matcher.max_rows // len(starts))
+                remaining = 0
+                for i, start in enumerate(starts):
+                    remaining += per_range
+                    remaining -= run_scan(
+                        [matcher],
+                        collectors,
+                        start_nid=start,
+                        end_nid=starts[i + 1] if i + 1 < len(starts) else None,
+                        max_rows=remaining,
+                    )
+                if starts[0] and remaining > 0:
+                    run_scan(
+                        [matcher],
+                        collectors,
+                        end_nid=starts[0],
+                        max_rows=remaining,
+                    )
+            elif matcher.seek:
+                # the unary plus keeps SQLite from preferring the notetype index
+                run_scan([matcher], collectors, f"+{mid_clause}")
+
+    collected = {i: collector.results() for i, collector in collectors.items()}
+    note_mids: Dict[NoteId, int] = {}
+    if len(mids) > 1:
+        note_mids = {
+            NoteId(nid): mid
+            for nid, mid in col.db.all(
+                "select id, mid from notes where id in %s"
+                % ids2str(nid for rows in collected.values() for nid, _ in rows)
+            )
+        }
+    for i, collector in collectors.items():
+        query = queries[i]
+        copyaround = results[i][1]
+        copyaround.cursor = collector.cursor()
+        for nid, dest_note in collected[i]:
+            related_note = build_related_note(
+                col,
+                note_mids.get(nid, mids[0]),
+                nid,
+                dest_note,
+                query.copy_from_fields,
+                query.subs2srs_info,
+                other_col,
+            )
+            if related_note:
+                copyaround.related_notes[nid] = related_note
+
+    return results
+
+
 def get_related(
     note: Note,
     notetype_name: str,
@@ -117,114 +1008,218 @@ def get_related(
     shuffle: bool = False,
     subs2srs_info: Optional[Subs2srsOptions] = None,
     other_col: Optional[Collection] = None,
+    link_table: Optional[LinkTable] = None,
+    match: str = MATCH_SUBSTRING,
+    order: str = "",
+    seed: Optional[int] = None,
+    nids: Optional[List[NoteId]] = None,
+    after: Optional[Cursor] = None,
+    col: Optional[Collection] = None,
+    dedupe: bool = False,
+    fuzzy: int = 0,
+    deck: str = "",
+    tag: str = "",
+    exclude_tag: str = "",
 ) -> Tuple[str, CopyAroundRelated]:
+    query = RelatedQuery(
+        search_field,
+        search_in_field,
+        copy_from_fields,
+        max_notes,
+        shuffle,
+        subs2srs_info,
+        match,
+        order,
+        seed,
+        nids,
+        after,
+        dedupe,
+        fuzzy,
+        deck,
+        tag,
+        exclude_tag,
+    )
+    return get_related_many(note, notetype_name, [query], other_col, link_table, col)[0]
 
-    copyaround = CopyAroundRelated(note.id, {})
+
+def count_related(
+    note: Note,
+    notetype_name: str,
+    search_field: str,
+    search_in_field: str,
+    copy_from_fields: List[str],
+    limit: int,
+    match: str = MATCH_SUBSTRING,
+    fuzzy: int = 0,
+    deck: str = "",
+    tag: str = "",
+    exclude_tag: str = "",
+    other_col: Optional[Collection] = None,
+    col: Optional[Collection] = None,
+) -> int:
+    """Return the number of notes get_related() would match, counting at most `limit` of them,
+    without fetching or processing their fields."""
     if other_col:
         col = other_col
-    else:
+    elif not col:
         col = mw.col
-    notetype = col.models.by_name(notetype_name)
-    if not notetype:
-        return "", copyaround
-    mid = notetype["id"]
-    field_ords = {}
-    for f in notetype["flds"]:
-        field_ords[f["name"]] = f["ord"]
-    search_text = stripHTML(note[search_field])
-    search_text = unicodedata.normalize("NFC", search_text)
-    escaped_search = to_sql(search_text)
-    where_params: List[Any] = []
-    field_params: List[Any] = []
-    if search_in_field:
-        if search_in_field not in field_ords:
-            return search_text, copyaround
-        where_clause = "field_at_index(n.flds, ?) like '%' || ? || '%' escape '\\'"
-        where_params.append(field_ords[search_in_field])
-        where_params.append(escaped_search)
-    else:
-        where_clause = "(sfld like '%' || ? || '%' escape '\\' or flds like '%' || ? || '%' escape '\\')"
-        where_params.append(escaped_search)
-        where_params.append(escaped_search)
-    where_clause += " and n.id != ? and n.mid = ?"
-    where_params.append(note.id)
-    where_params.append(mid)
-    subqueries = []
-    for i, field in enumerate(copy_from_fields):
-        subqueries.append(f"f{i} != ''")
+    sources = get_notetype_sources(col, notetype_name)
+    if not sources:
+        return 0
+    fields = _SourceFields(sources)
+    query = RelatedQuery(
+        search_field,
+        search_in_field,
+        copy_from_fields,
+        match=match,
+        fuzzy=fuzzy,
+        deck=deck,
+        tag=tag,
+        exclude_tag=exclude_tag,
+    )
+    search_text = get_search_text(note, search_field)
+    matcher = _build_matcher(col, fields, 0, query, note, search_text, [])
+    if not matcher:
+        return 0
+    mid_clause = f"n.mid in {ids2str(fields.mids)}"
+    if matcher.verify_field is None:
+        return col.db.scalar(
+            f"select count() from (select 1 from notes n where {mid_clause} and ({matcher.condition}) limit ?)",
+            *matcher.params,
+            limit,
+        )
+    # exact matches are verified against the stripped contents of their fields
+    verify_fields = [matcher.verify_field] if matcher.verify_field else fields.names
+    verify_sql = ", ".join(fields.sql(name)[0] for name in verify_fields)
+    verify_params = [param for name in verify_fields for param in fields.sql(name)[1]]
+    count = 0
+    last_nid = 0
+    while count < limit:
+        rows = col.db.all(
+            f"select n.id, {verify_sql} from notes n where {mid_clause} and n.id > ? and ({matcher.condition}) order by n.id limit ?",
+            *verify_params,
+            last_nid,
+            *matcher.params,
+            SCAN_PAGE_SIZE,
+        )
+        count += sum(
+            1
+            for _, *values in rows
+            if any(is_exact_match(value, matcher.pattern) for value in values)
+        )
+        if len(rows) < SCAN_PAGE_SIZE:
+            break
+        last_nid = rows[-1][0]
+    return min(count, limit)
+
+
+_lookup_executor = ThreadPoolExecutor(
+    max_workers=LOOKUP_THREADS, thread_name_prefix=consts.FILTER_NAME
+)
+# lookups that are still running, keyed by their arguments
+_in_flight: Dict[Tuple, "Future[Tuple[str, CopyAroundRelated]]"] = {}
+_in_flight_lock = threading.Lock()
 
-    where_clause += f' and ({" or ".join(subqueries)})'
-    query = "select n.id, {field_subquery} from notes n where {where_clause}"
-    subqueries = []
-    for i, field in enumerate(copy_from_fields):
-        if field in field_ords:
-            subqueries.append(f"field_at_index(n.flds, ?) as f{i}")
-            field_params.append(field_ords[field])
-    if not subqueries:
-        # no requested fields exist in target notetype
-        return search_text, copyaround
 
-    query = query.format(
-        field_subquery=", ".join(subqueries), where_clause=where_clause
+def get_related_many_async(
+    note: Note,
+    notetype_name: str,
+    queries: List[RelatedQuery],
+    other_col: Optional[Collection] = None,
+    link_table: Optional[LinkTable] = None,
+) -> "Future[List[Tuple[str, CopyAroundRelated]]]":
+    """Run get_related_many() in the background."""
+    return _lookup_executor.submit(
+        get_related_many, note, notetype_name, queries, other_col, link_table
     )
-    params = field_params + where_params
-    # print(
-    #     f"copyaround: {query=} {search_text=} {escaped_search=} {params=} {other_col=}"
-    # )
-    results_list = col.db.all(query, *params)
-    # print(f"{results_list=}")
-    if shuffle:
-        random.shuffle(results_list)
-    if max_notes >= 0:
-        results_list = results_list[:max_notes]
-    for nid, *field_contents in results_list:
-        dest_note: Dict[str, str] = {}
-        for i, val in enumerate(field_contents):
-            if val:
-                dest_note[copy_from_fields[i]] = val
-        copied_fields = {}
-        subs2srs_text = ""
-        raw_subs2srs_text = ""
-        for copy_from_field in copy_from_fields:
-            if copy_from_field in dest_note:
-                contents = dest_note[copy_from_field]
-                if other_col:
-                    # UGLY HACK: copy media files from the other collection to the current collection
-                    # FIXME: find a better way to do this
-                    filenames = col.media.filesInStr(mid, contents)
-                    for filename in filenames:
-                        copy_to_current_col(col, filename)
-                copied_fields[copy_from_field] = RelatedField(
-                    copy_from_field, contents, contents
-                )
-        if subs2srs_info and (
-            subs2srs_context := getattr(mw, "subs2srs_context", None)
-        ):
-            # get info from previous and next sub2srs notes using the subs2srs-context add-on
-            # TODO: maybe factor out some of this logic to subs2srs-context
-            audio_buttons = subs2srs_context.get_audio_buttons(nid, flip=True, col=col)
-            audio_filenames = [
-                subs2srs_context.get_audio_filename(nid - 1, col=col),
-                subs2srs_context.get_audio_filename(nid + 1, col=col),
-            ]
-            for filename in audio_filenames:
-                copy_to_current_col(col, filename)
-            audio_tags = [
-                f"[sound:{filename}]" if filename else ""
-                for filename in audio_filenames
-            ]
-            expressions = subs2srs_context.get_expressions(nid, col=col)
-            subs2srs_text += f'<div class="copyaround-subs2srs-context" style="font-size: {subs2srs_info.font_size};">{expressions[0]}{audio_buttons[0]}{audio_buttons[1]}{expressions[1]}</div>'
-            if subs2srs_info.save:
-                raw_subs2srs_text += f'<div class="copyaround-subs2srs-context" style="font-size: {subs2srs_info.font_size};">{expressions[0]}{audio_tags[0]}{audio_tags[1]}{expressions[1]}</div>'
 
-        if copied_fields:
-            related_note = RelatedNote(
-                nid, copied_fields, subs2srs_text, raw_subs2srs_text
-            )
-            copyaround.related_notes[nid] = related_note
 
-    return search_text, copyaround
+def get_related_async(
+    note: Note,
+    notetype_name: str,
+    search_field: str,
+    search_in_field: str,
+    copy_from_fields: List[str],
+    max_notes: int = -1,
+    shuffle: bool = False,
+    subs2srs_info: Optional[Subs2srsOptions] = None,
+    other_col: Optional[Collection] = None,
+    link_table: Optional[LinkTable] = None,
+    match: str = MATCH_SUBSTRING,
+    order: str = "",
+    seed: Optional[int] = None,
+    nids: Optional[List[NoteId]] = None,
+    after: Optional[Cursor] = None,
+    col: Optional[Collection] = None,
+    dedupe: bool = False,
+    fuzzy: int = 0,
+    deck: str = "",
+    tag: str = "",
+    exclude_tag: str = "",
+) -> "Future[Tuple[str, CopyAroundRelated]]":
+    """Run get_related() in the background.
+    Identical lookups that are still running share the same future,
+    so the returned results must not be modified."""
+    key = (
+        note.id,
+        get_search_text(note, search_field),
+        notetype_name,
+        search_field,
+        search_in_field,
+        tuple(copy_from_fields),
+        max_notes,
+        shuffle,
+        dataclasses.astuple(subs2srs_info) if subs2srs_info else None,
+        id(other_col or col or mw.col),
+        id(link_table),
+        match,
+        order,
+        seed,
+        tuple(nids) if nids is not None else None,
+        tuple(after) if after else None,
+        dedupe,
+        fuzzy,
+        deck,
+        tag,
+        exclude_tag,
+    )
+    with _in_flight_lock:
+        fut = _in_flight.get(key)
+        if fut:
+            return fut
+        fut = _lookup_executor.submit(
+            get_related,
+            note,
+            notetype_name,
+            search_field,
+            search_in_field,
+            copy_from_fields,
+            max_notes,
+            shuffle,
+            subs2srs_info,
+            other_col,
+            link_table,
+            match,
+            order,
+            seed,
+            nids,
+            after,
+            col,
+            dedupe,
+            fuzzy,
+            deck,
+            tag,
+            exclude_tag,
+        )
+        _in_flight[key] = fut
+
+    def forget(fut: Future) -> None:
+        with _in_flight_lock:
+            if _in_flight.get(key) is fut:
+                del _in_flight[key]
+
+    fut.add_done_callback(forget)
+    return fut
 
 
 # TODO: remove this
@@ -328,6 +1323,12 @@ def format_note(nid: NoteId, formatted_fields: List[str]) -> str:
     )
 
 
+def copy_note_media(note: RelatedNote) -> None:
+    """Copy the files of a note served from another collection to the current collection."""
+    for filename in note.media_files:
+        copy_media_to_current_col(note.media_dir, filename)
+
+
 def format_note_for_saving(note: RelatedNote) -> str:
     fields = [format_field(k, v.raw_contents) for k, v in note.fields.items()]
     fields.append(note.raw_subs2srs_text)
@@ -350,11 +1351,24 @@ def get_related_content(
     side: str = "question",
     save_info: Optional[SaveInfo] = None,
     other_col: Optional[Collection] = None,
+    link_table: Optional[LinkTable] = None,
+    match: str = MATCH_SUBSTRING,
+    order: str = "",
+    seed: Optional[int] = None,
+    nids: Optional[List[NoteId]] = None,
+    thumbnails: Optional["ThumbnailCache"] = None,
+    after: Optional[Cursor] = None,
+    col: Optional[Collection] = None,
+    dedupe: bool = False,
+    fuzzy: int = 0,
+    deck: str = "",
+    tag: str = "",
+    exclude_tag: str = "",
 ) -> Tuple[str, CopyAroundRelated]:
 
     # benchmark()
 
-    search_text, copyaround = get_related(
+    search_text, copyaround = get_related_async(
         note,
         notetype_name,
         search_field,
@@ -364,12 +1378,54 @@ def get_related_content(
         shuffle,
         subs2srs_info,
         other_col,
+        link_table,
+        match,
+        order,
+        seed,
+        nids,
+        after,
+        col,
+        dedupe,
+        fuzzy,
+        deck,
+        tag,
+        exclude_tag,
+    ).result()
+    copied = format_related(
+        search_text,
+        copyaround,
+        highlight,
+        cloze,
+        delayed,
+        card,
+        side,
+        save_info,
+        thumbnails,
     )
+
+    return copied, copyaround
+
+
+def format_related(
+    search_text: str,
+    copyaround: CopyAroundRelated,
+    highlight: bool = False,
+    cloze: bool = False,
+    delayed: bool = False,
+    card: Optional[Card] = None,
+    side: str = "question",
+    save_info: Optional[SaveInfo] = None,
+    thumbnails: Optional["ThumbnailCache"] = None,
+) -> str:
     copied = ""
     for related in copyaround.related_notes.values():
         copied_fields = []
         for field_name, related_field in related.fields.items():
             processed_contents = related_field.processed_contents
+            if thumbnails:
+                processed_contents = thumbnails.rewrite_images(
+                    processed_contents, mw.col.media.dir()
+                )
 
             def wrap(match: Match) -> str:
                 text = match.group(0)
@@ -394,7 +1450,6 @@ def get_related_content(
                     "q" if side == "question" else "a",
                     card and card.autoplay(),
                 )
-            related_field.processed_contents = processed_contents
             copied_fields.append(format_field(field_name, processed_contents))
         if save_info and save_info.field:
             copied_fields.append(
@@ -409,7 +1464,7 @@ def get_related_content(
         if copied_fields:
             copied += format_note(related.nid, copied_fields)
 
-    return copied, copyaround
+    return copied
 
 
 def benchmark() -> None:
@@ -465,7 +1520,7 @@ def benchmark() -> None:
     ]
     tl1 = []
     tl2 = []
-    args = [
+    args: List[Any] = [
         "Word",
         "Expression",
         ["Expression", "Audio"],
@@ -481,11 +1536,11 @@ def benchmark() -> None:
     for word in words:
         nt = cast(Note, DummyNote(Word=word))
         t1 = timeit(
-            lambda nt=nt: get_related_old(nt, "bulk", *args),
+            lambda: get_related_old(nt, "bulk", *args),
             number=1,
         )
         t2 = timeit(
-            lambda nt=nt: get_related(nt, "subs2srs", *args),
+            lambda: get_related(nt, "subs2srs", *args),
             number=1,
         )
         tl1.append(t1)
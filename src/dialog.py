@@ -1,8 +1,12 @@
+import dataclasses
+import functools
+import html
 from concurrent.futures import Future
-from typing import List, Optional, Tuple
+from typing import Any, Callable, Dict, List, Optional, Tuple
 
+from anki.collection import Collection
 from anki.models import NotetypeId
-from anki.notes import Note
+from anki.notes import Note, NoteId
 from aqt import qtmajor
 from aqt.main import AnkiQt
 from aqt.notetypechooser import NotetypeChooser
@@ -10,7 +14,21 @@ from aqt.qt import *
 from aqt.utils import showWarning
 
 from . import consts
-from .copy_around import get_related_content
+from .cli import BulkJob
+from .copy_around import (
+    MATCH_EXACT,
+    MATCH_SUBSTRING,
+    ORDER_DENSITY,
+    ORDER_POSITION,
+    ORDER_RECENT,
+    ORDER_SHORTEST,
+    count_related,
+    get_notetype_sources,
+    get_related_content,
+    get_search_text,
+)
+from .gui import link_table_manager
+from .signatures import SignatureStore, make_signature, targets_state
 
 if qtmajor > 5:
     from .forms.form_qt6 import Ui_Dialog
@@ -19,6 +37,21 @@ else:
 
 
 PROGRESS_LABEL = "Processed {count} out of {total} note(s)"
+# Number of selected notes whose results are previewed
+PREVIEW_NOTES = 3
+# Number of related notes shown for each previewed note
+PREVIEW_SAMPLE_SIZE = 2
+# Matches are only counted up to this number
+PREVIEW_COUNT_LIMIT = 1000
+# Delay after the last change of options before the preview is updated
+PREVIEW_DELAY_MS = 300
+RESULT_ORDERS = [
+    ("Any", ""),
+    ("Shortest text", ORDER_SHORTEST),
+    ("Earliest match", ORDER_POSITION),
+    ("Match density", ORDER_DENSITY),
+    ("Most recent note", ORDER_RECENT),
+]
 
 
 class CopyAroundDialog(QDialog):
@@ -49,6 +82,22 @@ class CopyAroundDialog(QDialog):
             self.form.searchInFieldCheckBox.toggled,
             self.form.searchInFieldComboBox.setEnabled,
         )
+        qconnect(
+            self.form.fuzzyMatchCheckBox.toggled,
+            self.form.fuzzyMatchSpinBox.setEnabled,
+        )
+        # results are either randomized or ordered
+        qconnect(
+            self.form.randomizeCheckBox.toggled,
+            lambda checked: self.form.orderComboBox.setEnabled(not checked),
+        )
+        for label, order in RESULT_ORDERS:
+            self.form.orderComboBox.addItem(label, order)
+        self.form.deckComboBox.addItem("(all decks)", "")
+        for deck in sorted(
+            d.name for d in self.mw.col.decks.all_names_and_ids(include_filtered=False)
+        ):
+            self.form.deckComboBox.addItem(deck, deck)
         self.src_fields: List[str] = []
         # TODO: optimize
         for note in self.notes:
@@ -57,6 +106,30 @@ class CopyAroundDialog(QDialog):
                     self.src_fields.append(field)
         self.form.searchFieldComboBox.addItems(self.src_fields)
         self.form.copyIntoFieldComboBox.addItems(self.src_fields)
+        self.form.previewBrowser.setSearchPaths([self.mw.col.media.dir()])
+        # incremented on each change of options, so that outdated previews are dropped
+        self.preview_generation = 0
+        self.preview_timer = QTimer(self)
+        self.preview_timer.setSingleShot(True)
+        self.preview_timer.setInterval(PREVIEW_DELAY_MS)
+        qconnect(self.preview_timer.timeout, self._update_preview)
+        for signal in (
+            self.form.searchFieldComboBox.currentIndexChanged,
+            self.form.searchInFieldCheckBox.toggled,
+            self.form.searchInFieldComboBox.currentIndexChanged,
+            self.form.copyFromListWidget.itemSelectionChanged,
+            self.form.matchedNotesLimitCheckBox.toggled,
+            self.form.matchedNotesSpinBox.valueChanged,
+            self.form.randomizeCheckBox.toggled,
+            self.form.exactMatchCheckBox.toggled,
+            self.form.fuzzyMatchCheckBox.toggled,
+            self.form.fuzzyMatchSpinBox.valueChanged,
+            self.form.orderComboBox.currentIndexChanged,
+            self.form.deckComboBox.currentIndexChanged,
+            self.form.tagLineEdit.textChanged,
+            self.form.excludeTagLineEdit.textChanged,
+        ):
+            qconnect(signal, self._schedule_preview)
 
     def exec(self) -> int:
         mids = set(note.mid for note in self.notes)
@@ -116,6 +189,26 @@ class CopyAroundDialog(QDialog):
         randomize_results = self.config["randomize_results"]
         self.form.randomizeCheckBox.setChecked(randomize_results)
 
+        exact_match = self.config["exact_match"]
+        self.form.exactMatchCheckBox.setChecked(exact_match)
+
+        fuzzy_match = self.config["fuzzy_match"]
+        if fuzzy_match > 0:
+            self.form.fuzzyMatchCheckBox.setChecked(True)
+            self.form.fuzzyMatchSpinBox.setValue(fuzzy_match)
+
+        results_order = self.config["results_order"]
+        i = self.form.orderComboBox.findData(results_order)
+        if i >= 0:
+            self.form.orderComboBox.setCurrentIndex(i)
+
+        i = self.form.deckComboBox.findData(self.config["search_deck"])
+        if i >= 0:
+            self.form.deckComboBox.setCurrentIndex(i)
+        self.form.tagLineEdit.setText(self.config["include_tags"])
+        self.form.excludeTagLineEdit.setText(self.config["exclude_tags"])
+        self.form.incrementalCheckBox.setChecked(self.config["skip_unchanged_notes"])
+
         return super().exec()
 
     def _get_field(self, fields: List[str], key: str) -> Tuple[int, Optional[str]]:
@@ -134,41 +227,96 @@ class CopyAroundDialog(QDialog):
         self.form.copyFromListWidget.addItems(self.dest_fields)
         self.form.searchInFieldComboBox.clear()
         self.form.searchInFieldComboBox.addItems(self.dest_fields)
+        self._schedule_preview()
 
-    def _process_notes(
-        self,
-        notetype: str,
-        search_field: str,
-        copy_into_field: str,
-        search_in_field: str,
-        copy_from_fields: List[str],
-        max_notes: int,
-        randomize_results: bool,
-    ) -> None:
-        self.updated_notes = []
-        for i, note in enumerate(self.notes):
-            if i % 20 == 0:
-                self.mw.taskman.run_on_main(
-                    lambda i=i: self.mw.progress.update(
-                        label=PROGRESS_LABEL.format(count=i, total=len(self.notes)),
-                        value=i + 1,
-                        max=len(self.notes),
-                    )
-                )
+    def _schedule_preview(self, *args: Any) -> None:
+        # drop the results of lookups that are still running
+        self.preview_generation += 1
+        self.preview_timer.start()
+
+    def _update_preview(self) -> None:
+        job = self._get_job()
+        if not job.copy_from_fields:
+            self.form.previewBrowser.setHtml(
+                "<i>Select the fields to leech from to preview results.</i>"
+            )
+            return
+        generation = self.preview_generation
+        notes = self.notes[:PREVIEW_NOTES]
+
+        def is_outdated() -> bool:
+            return generation != self.preview_generation
+
+        def on_done(fut: Future) -> None:
+            if is_outdated() or not self.isVisible():
+                return
+            try:
+                self.form.previewBrowser.setHtml(fut.result())
+            except Exception as exc:
+                self.form.previewBrowser.setPlainText(f"Failed to preview: {exc}")
+
+        self.form.previewBrowser.setHtml("<i>Searching...</i>")
+        self.mw.taskman.run_in_background(
+            lambda: self._preview_notes(notes, job, is_outdated), on_done=on_done
+        )
+
+    def _preview_notes(
+        self, notes: List[Note], job: BulkJob, is_outdated: Callable[[], bool]
+    ) -> str:
+        sample_size = (
+            min(job.max_notes, PREVIEW_SAMPLE_SIZE)
+            if job.max_notes > 0
+            else PREVIEW_SAMPLE_SIZE
+        )
+        parts = []
+        for note in notes:
+            if is_outdated():
+                # the options changed, so the results won't be shown
+                break
+            search_text = get_search_text(note, job.search_field)
+            count = count_related(
+                note,
+                job.notetype,
+                job.search_field,
+                job.search_in_field,
+                job.copy_from_fields,
+                PREVIEW_COUNT_LIMIT + 1,
+                match=job.match,
+                fuzzy=job.fuzzy,
+                deck=job.deck,
+                tag=job.tag,
+                exclude_tag=job.exclude_tag,
+            )
             copied, _ = get_related_content(
                 note,
-                notetype,
-                search_field,
-                search_in_field,
-                copy_from_fields,
-                max_notes,
-                randomize_results,
+                job.notetype,
+                job.search_field,
+                job.search_in_field,
+                job.copy_from_fields,
+                sample_size,
+                job.shuffle,
+                match=job.match,
+                order=job.order,
+                fuzzy=job.fuzzy,
+                deck=job.deck,
+                tag=job.tag,
+                exclude_tag=job.exclude_tag,
             )
-            if copied:
-                note[copy_into_field] = copied
-                self.updated_notes.append(note)
+            parts.append(
+                "<p><b>{}</b>: {} matched note(s)</p>{}".format(
+                    html.escape(search_text),
+                    f"{PREVIEW_COUNT_LIMIT}+" if count > PREVIEW_COUNT_LIMIT else count,
+                    copied,
+                )
+            )
+        if len(self.notes) > len(notes):
+            parts.append(
+                f"<p><i>and {len(self.notes) - len(notes)} more note(s)</i></p>"
+            )
+        return "<hr>".join(parts)
 
-    def on_copy(self) -> None:
+    def _get_job(self) -> BulkJob:
+        """Return the options chosen in the dialog."""
         search_field = self.src_fields[self.form.searchFieldComboBox.currentIndex()]
         copy_into_field = self.src_fields[
             self.form.copyIntoFieldComboBox.currentIndex()
@@ -189,15 +337,137 @@ class CopyAroundDialog(QDialog):
             else -1
         )
         randomize_results = self.form.randomizeCheckBox.isChecked()
+        exact_match = self.form.exactMatchCheckBox.isChecked()
+        results_order = self.form.orderComboBox.currentData()
+        fuzzy_match = (
+            self.form.fuzzyMatchSpinBox.value()
+            if self.form.fuzzyMatchCheckBox.isChecked()
+            else 0
+        )
+        return BulkJob(
+            notetype=notetype,
+            search_field=search_field,
+            copy_into_field=copy_into_field,
+            search_in_field=search_in_field,
+            copy_from_fields=copy_from_fields,
+            max_notes=max_notes,
+            shuffle=randomize_results,
+            match=MATCH_EXACT if exact_match else MATCH_SUBSTRING,
+            order="" if randomize_results else results_order,
+            fuzzy=fuzzy_match,
+            deck=self.form.deckComboBox.currentData(),
+            tag=self.form.tagLineEdit.text().strip(),
+            exclude_tag=self.form.excludeTagLineEdit.text().strip(),
+        )
+
+    def _get_job_key(self, job: BulkJob) -> str:
+        # runs copying into the same field from the same notetype share their signatures
+        return make_signature("bulk", job.notetype, job.copy_into_field)
+
+    def _get_signature(self, job: BulkJob, state: List, note: Note) -> str:
+        """Return the signature of the inputs of the job's run on a note.
+        The copied field is included so that notes edited by hand since are processed again."""
+        return make_signature(
+            get_search_text(note, job.search_field),
+            dataclasses.asdict(job),
+            state,
+            note[job.copy_into_field],
+        )
+
+    def _get_targets_state(self, col: Collection, job: BulkJob) -> List:
+        # the results of a note only change with its inputs or the searched notes
+        return targets_state(
+            col,
+            [source.mid for source in get_notetype_sources(col, job.notetype)],
+            job.deck,
+        )
+
+    def _process_notes(self, job: BulkJob, incremental: bool) -> None:
+        self.updated_notes = []
+        self.skipped_count = 0
+        self.job = job
+        state = self._get_targets_state(self.mw.col, job)
+        previous: Dict[NoteId, str] = {}
+        if incremental:
+            store = SignatureStore(link_table_manager.path)
+            try:
+                previous = store.get(self._get_job_key(job))
+            finally:
+                store.close()
+        for i, note in enumerate(self.notes):
+            if i % 20 == 0:
+                self.mw.taskman.run_on_main(
+                    functools.partial(
+                        self.mw.progress.update,
+                        label=PROGRESS_LABEL.format(count=i, total=len(self.notes)),
+                        value=i + 1,
+                        max=len(self.notes),
+                    )
+                )
+            if note.id in previous and previous[note.id] == self._get_signature(
+                job, state, note
+            ):
+                self.skipped_count += 1
+                continue
+            copied, _ = get_related_content(
+                note,
+                job.notetype,
+                job.search_field,
+                job.search_in_field,
+                job.copy_from_fields,
+                job.max_notes,
+                job.shuffle,
+                match=job.match,
+                order=job.order,
+                fuzzy=job.fuzzy,
+                deck=job.deck,
+                tag=job.tag,
+                exclude_tag=job.exclude_tag,
+            )
+            if copied:
+                note[job.copy_into_field] = copied
+                self.updated_notes.append(note)
+
+    def save_signatures(self, col: Collection) -> None:
+        """Record the signatures of the processed notes, which should be called once they're written,
+        so that incremental runs can skip them.
+        They're based on the state of the searched notes after the run, so that its own writes
+        don't cause the next run to process the notes again."""
+        state = self._get_targets_state(col, self.job)
+        store = SignatureStore(link_table_manager.path)
+        try:
+            store.put(
+                self._get_job_key(self.job),
+                (
+                    (note.id, self._get_signature(self.job, state, note))
+                    for note in self.notes
+                ),
+            )
+        finally:
+            store.close()
+
+    def on_copy(self) -> None:
+        job = self._get_job()
+        # the preview is no longer needed
+        self.preview_timer.stop()
+        self.preview_generation += 1
 
         # save options
-        self.config["search_field"] = search_field
-        self.config["copy_into_field"] = copy_into_field
-        self.config["copy_from_notetype"] = notetype
-        self.config["search_in_field"] = search_in_field
-        self.config["copy_from_fields"] = copy_from_fields
-        self.config["matched_notes_limit"] = max_notes
-        self.config["randomize_results"] = randomize_results
+        self.config["search_field"] = job.search_field
+        self.config["copy_into_field"] = job.copy_into_field
+        self.config["copy_from_notetype"] = job.notetype
+        self.config["search_in_field"] = job.search_in_field
+        self.config["copy_from_fields"] = job.copy_from_fields
+        self.config["matched_notes_limit"] = job.max_notes
+        self.config["randomize_results"] = job.shuffle
+        self.config["exact_match"] = job.match == MATCH_EXACT
+        self.config["fuzzy_match"] = job.fuzzy
+        self.config["search_deck"] = job.deck
+        self.config["include_tags"] = job.tag
+        self.config["exclude_tags"] = job.exclude_tag
+        self.config["results_order"] = self.form.orderComboBox.currentData()
+        incremental = self.form.incrementalCheckBox.isChecked()
+        self.config["skip_unchanged_notes"] = incremental
 
         self.mw.addonManager.writeConfig(__name__, self.config)
 
@@ -215,14 +485,5 @@ class CopyAroundDialog(QDialog):
         )
         self.mw.progress.set_title(consts.ADDON_NAME)
         self.mw.taskman.run_in_background(
-            lambda: self._process_notes(
-                notetype,
-                search_field,
-                copy_into_field,
-                search_in_field,
-                copy_from_fields,
-                max_notes,
-                randomize_results,
-            ),
-            on_done=on_done,
+            lambda: self._process_notes(job, incremental), on_done=on_done
         )
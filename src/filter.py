@@ -1,37 +1,88 @@
 import dataclasses
 import json
+import os
+import random
 import re
-from typing import Any, Dict, List, Optional, Tuple
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from typing import Any, Callable, Dict, List, Optional, Tuple
 
 from anki.cards import Card
-from anki.hooks import field_filter
+from anki.collection import Collection
 from anki.notes import Note, NoteId
 from anki.template import TemplateRenderContext
 from aqt import mw
 from aqt.browser.previewer import Previewer
 from aqt.clayout import CardLayout
 from aqt.editor import Editor
-from aqt.gui_hooks import state_shortcuts_will_change, webview_did_receive_js_message
 from aqt.qt import *
 from aqt.utils import tooltip
 from aqt.webview import AnkiWebView
 
 from . import consts
 from .copy_around import (
+    MATCH_SUBSTRING,
     CopyAroundRelated,
+    RelatedQuery,
     SaveInfo,
     Subs2srsOptions,
+    copy_note_media,
     format_note_for_saving,
+    format_related,
+    get_related_async,
     get_related_content,
+    get_related_many,
+    get_related_many_async,
 )
+from .gui import collection_manager, link_table_manager
+from .materialized import LinkTable
+from .results_store import FilterResultsStore, StoredResults
+from .thumbnails import THUMBNAILS_FOLDER, ThumbnailCache
 
 # FIXME: doesn't work with values that contain double quotes
 FILTER_OPTION_RE = re.compile(r'((?P<key>\w+)\s*=\s*(?P<value>(".*")|\S*))')
+TEMPLATE_FILTER_RE = re.compile(r"\{\{([^{}]+)\}\}")
+# Contents of fields that Anki considers empty in conditional sections
+EMPTY_FIELD_RE = re.compile(r"^(?:\s|</?(?:br|div) ?/?>)*$", re.IGNORECASE)
+PREFETCHED_STATE_KEY = f"{consts.FILTER_NAME}_prefetched"
+RENDER_SEED_STATE_KEY = f"{consts.FILTER_NAME}_seed"
+# Time the rendering of a card started at, from which the time budgets of its filters are counted
+RENDER_START_STATE_KEY = f"{consts.FILTER_NAME}_start"
 
 TRIGGER_FILTER_BUTTON_SHORTCUT = consts.CONFIG["trigger_filter_button_shortcut"]
-TOGGLE_BUTTON = """<button id="copyaround-toggle-{toggle_id}" class="copyaround-toggle" title="Shortcut: {shortcut}" onclick="pycmd('{cmd}:show:{data}'); return false;" style="display: block; margin: 5px auto;">{label}</button>"""
-
-FILTER_CONTEXT: List[CopyAroundRelated] = []
+LOADING_LABEL = "Loading..."
+# Marks a toggle button as loading, returning whether it wasn't clicked before
+MARK_TOGGLE_JS = f"""if(toggle.dataset.rendered) return false;
+toggle.dataset.rendered = true;
+toggle.dataset.label = toggle.textContent;
+toggle.textContent = '{LOADING_LABEL}';
+toggle.disabled = true;
+return true;"""
+# Buttons refer to filters by their ID in the stored results of the webview
+TOGGLE_BUTTON = """<button id="copyaround-toggle-{toggle_id}" class="copyaround-toggle" data-toggle-id="{toggle_id}" title="Shortcut: {shortcut}" onclick="if(((toggle) => {{{mark}}})(this)) pycmd('{cmd}:show:{toggle_id}'); return false;" style="display: block; margin: 5px auto;">{label}</button>"""
+MORE_LABEL = "More"
+# Shown instead of the results of a filter that ran over its time budget until they're ready.
+# It requests them each time it's shown, as the rendered card is shown again on the answer side
+PENDING_PLACEHOLDER = """<div id="copyaround-pending-{toggle_id}" class="copyaround-pending" style="text-align: center; margin: 5px auto;">{label}<script>pycmd('{cmd}:pending:{toggle_id}');</script></div>"""
+MORE_BUTTON = f"""<button id="copyaround-more-{{toggle_id}}" class="copyaround-more" onclick="this.textContent = '{LOADING_LABEL}'; this.disabled = true; pycmd('{{cmd}}:more:{{toggle_id}}'); return false;" style="display: block; margin: 5px auto;">{{label}}</button>"""
+
+# Results of the filters of the card rendered in each webview, used by the add button
+RESULTS_STORE = FilterResultsStore()
+
+# Seed of the current review session. Shuffled results of a card stay the same
+# on both sides and across re-renders until the next session starts.
+SESSION_SEED = random.getrandbits(64)
+# Note IDs sampled by shuffled filters, keyed by card ID, note modification time, filter name and field name
+SAMPLE_CACHE: "OrderedDict[Tuple[int, int, str, str], List[NoteId]]" = OrderedDict()
+SAMPLE_CACHE_SIZE = 500
+
+THUMBNAIL_CACHE = ThumbnailCache(
+    os.path.join(consts.USER_FILES_DIR, THUMBNAILS_FOLDER),
+    consts.CONFIG["thumbnail_size"],
+    consts.CONFIG["thumbnail_cache_size_mb"] * 1024 * 1024,
+)
 
 
 @dataclasses.dataclass
@@ -84,23 +135,35 @@ def get_bool_filter_option(options: Dict, key: str, default: bool = True) -> boo
     return (options[key].lower() == "true") if key in options else default
 
 
-def add_filter(
-    field_text: str,
-    field_name: str,
-    filter_name: str,
-    ctx: TemplateRenderContext,
-) -> str:
-
-    if not filter_name.startswith(consts.FILTER_NAME):
-        return field_text
-
-    if not ctx.extra_state.get(consts.FILTER_NAME, None):
-        # Reset global context at render time of each card
-        global FILTER_CONTEXT
-        FILTER_CONTEXT = []
-        ctx.extra_state[consts.FILTER_NAME] = FILTER_CONTEXT
-    filter_id = len(ctx.extra_state.get(consts.FILTER_NAME))
-
+@dataclasses.dataclass
+class FilterOptions:
+    notetype_name: str
+    search_in: str
+    leech_from: List[str]
+    count: int
+    shuffle: bool
+    highlight: bool
+    cloze: bool
+    delayed: bool
+    subs2srs_info: Optional[Subs2srsOptions]
+    use_other_col: bool
+    materialize: bool
+    save_field: str
+    label: str
+    match: str
+    order: str
+    thumbnails: bool
+    more: bool
+    dedupe: bool
+    fuzzy: int
+    deck: str
+    tag: str
+    exclude_tag: str
+    # milliseconds to wait for the results before showing them once they're ready instead (no limit if 0)
+    budget: int
+
+
+def parse_filter_options(filter_name: str) -> FilterOptions:
     options = {}
     options_text = filter_name.split(maxsplit=1)[1]
     for match in FILTER_OPTION_RE.finditer(options_text):
@@ -109,132 +172,699 @@ def add_filter(
         value = pair["value"].strip('"')
         options[key] = value
 
-    notetype_name = options.get("notetype", "Basic")
-    search_in = options.get("search_in", "")
-    leech_from = options["leech_from"].split(",")
-    count = int(options.get("count", 1))
-    shuffle = get_bool_filter_option(options, "shuffle")
-    highlight = get_bool_filter_option(options, "highlight")
-    cloze = get_bool_filter_option(options, "cloze", False)
-    delayed = get_bool_filter_option(options, "delayed", False)
     subs2srs = get_bool_filter_option(options, "subs2srs", False)
-    use_other_col = get_bool_filter_option(options, "other_col", False)
     subs2srs_fontsize = options.get("subs2srs-fontsize", "smaller")
-    save_field = options.get("save_field", "")
-    save_info = SaveInfo(save_field, filter_id)
     save_subs2srs = consts.CONFIG["save_subs2srs"]
     subs2srs_info = None
     if subs2srs:
         subs2srs_info = Subs2srsOptions(subs2srs_fontsize, save_subs2srs)
 
-    label = options.get("label", consts.ADDON_NAME)
-    context = get_active_card_view_context()
-    if delayed:
-        data = dict(
-            toggle_id=filter_id,
-            cid=ctx.card().id,
-            notetype_name=notetype_name,
-            search_field=field_name,
-            search_in_field=search_in,
-            copy_from_fields=leech_from,
-            max_notes=count,
-            shuffle=shuffle,
-            highlight=highlight,
-            cloze=cloze,
-            subs2srs_info=dataclasses.asdict(subs2srs_info) if subs2srs_info else {},
-            # FIXME: this should be the side where the filter was included,
-            # but I don't know of a way to get that kind of info here
-            side="a",
-            save_info=dataclasses.asdict(save_info),
-            use_other_col=use_other_col,
+    return FilterOptions(
+        notetype_name=options.get("notetype", "Basic"),
+        search_in=options.get("search_in", ""),
+        leech_from=options["leech_from"].split(","),
+        count=int(options.get("count", 1)),
+        shuffle=get_bool_filter_option(options, "shuffle"),
+        highlight=get_bool_filter_option(options, "highlight"),
+        cloze=get_bool_filter_option(options, "cloze", False),
+        delayed=get_bool_filter_option(options, "delayed", False),
+        subs2srs_info=subs2srs_info,
+        use_other_col=get_bool_filter_option(options, "other_col", False),
+        materialize=get_bool_filter_option(options, "materialize", False),
+        save_field=options.get("save_field", ""),
+        label=options.get("label", consts.ADDON_NAME),
+        match=options.get("match", MATCH_SUBSTRING),
+        order=options.get("order", ""),
+        thumbnails=get_bool_filter_option(options, "thumbnails", False),
+        more=get_bool_filter_option(options, "more", False),
+        dedupe=get_bool_filter_option(options, "dedupe", False),
+        fuzzy=int(options.get("fuzzy", 0)),
+        deck=options.get("deck", ""),
+        tag=options.get("tag", ""),
+        exclude_tag=options.get("exclude_tag", ""),
+        budget=int(options.get("budget", consts.CONFIG["filter_time_budget_ms"])),
+    )
+
+
+def get_other_col(options: FilterOptions) -> Optional[Collection]:
+    if options.use_other_col:
+        return collection_manager.col
+    return None
+
+
+def get_link_table(options: FilterOptions) -> Optional[LinkTable]:
+    if options.materialize:
+        return link_table_manager.table
+    return None
+
+
+def get_thumbnail_cache(options: FilterOptions) -> Optional[ThumbnailCache]:
+    if options.thumbnails:
+        return THUMBNAIL_CACHE
+    return None
+
+
+def get_sample_key(
+    ctx: TemplateRenderContext, filter_name: str, field_name: str
+) -> Optional[Tuple[int, int, str, str]]:
+    cid = ctx.card().id
+    if not cid:
+        return None
+    # the note's modification time invalidates samples of edited notes
+    return (cid, ctx.note().mod, filter_name.strip(), field_name.strip())
+
+
+def get_filter_seed(
+    ctx: TemplateRenderContext,
+    key: Optional[Tuple[int, int, str, str]],
+    filter_name: str,
+    field_name: str,
+) -> int:
+    """Return the seed used to shuffle the results of a filter.
+    Cards that were not saved yet are reshuffled on each render."""
+    if key:
+        return hash((SESSION_SEED, *key))
+    if RENDER_SEED_STATE_KEY not in ctx.extra_state:
+        ctx.extra_state[RENDER_SEED_STATE_KEY] = random.getrandbits(64)
+    return hash(
+        (
+            ctx.extra_state[RENDER_SEED_STATE_KEY],
+            filter_name.strip(),
+            field_name.strip(),
         )
-        data_json = json.dumps(data).replace('"', "&quot;")
+    )
+
+
+def get_sampled_nids(
+    key: Optional[Tuple[int, int, str, str]]
+) -> Optional[List[NoteId]]:
+    if not key:
+        return None
+    return SAMPLE_CACHE.get(key)
+
+
+def remember_sample(
+    key: Optional[Tuple[int, int, str, str]], related: CopyAroundRelated
+) -> None:
+    if not key:
+        return
+    SAMPLE_CACHE[key] = list(related.related_notes)
+    SAMPLE_CACHE.move_to_end(key)
+    while len(SAMPLE_CACHE) > SAMPLE_CACHE_SIZE:
+        SAMPLE_CACHE.popitem(last=False)
+
+
+def start_sampling_session() -> None:
+    global SESSION_SEED
+    SESSION_SEED = random.getrandbits(64)
+    SAMPLE_CACHE.clear()
+
+
+def on_state_did_change(new_state: str, old_state: str) -> None:
+    if new_state == "review" and old_state != "review":
+        start_sampling_session()
+
+
+def is_section_shown(note: Note, tag: str) -> bool:
+    """Return whether a conditional section opened by `tag` (e.g. "#Field" or "^Field") is rendered."""
+    name = tag[1:].strip()
+    if name in note:
+        empty = bool(EMPTY_FIELD_RE.match(note[name]))
+    elif name == "Tags":
+        empty = not note.tags
+    else:
+        # other special fields aren't evaluated, so the filters of their sections aren't prefetched
+        return False
+    return empty == (tag[0] == "^")
+
+
+def find_template_filters(ctx: TemplateRenderContext) -> List[Tuple[str, str]]:
+    """Return the (filter name, field name) pairs of the copyaround filters rendered on the card,
+    skipping the ones in conditional sections that aren't shown."""
+    try:
+        template = ctx.card().template()
+        note = ctx.note()
+    except:
+        return []
+    filters = []
+    for text in (str(template["qfmt"]), str(template["afmt"])):
+        # whether each enclosing section is shown
+        sections: List[bool] = []
+        for match in TEMPLATE_FILTER_RE.finditer(text):
+            tag = match.group(1).strip()
+            if tag[:1] in ("#", "^"):
+                sections.append(is_section_shown(note, tag))
+            elif tag[:1] == "/":
+                if sections:
+                    sections.pop()
+            elif all(sections):
+                *filter_names, field_name = tag.split(":")
+                for filter_name in filter_names:
+                    filter_name = filter_name.strip()
+                    if filter_name.startswith(consts.FILTER_NAME):
+                        filters.append((filter_name, field_name.strip()))
+    return filters
+
+
+def prefetch_template_filters(
+    ctx: TemplateRenderContext,
+) -> Dict[
+    Tuple[str, str], List[Tuple["Future[List[Tuple[str, CopyAroundRelated]]]", int]]
+]:
+    """Start looking up the results of all copyaround filters of the card in as few scans as possible.
+    Filters searching the same notetype are coalesced into a single query.
+    Returns the lookup of each filter and the index of its results in the lookup's results."""
+    groups: Dict[Tuple[str, bool, bool], List[Tuple[str, str, FilterOptions]]] = {}
+    sample_keys = {}
+    for filter_name, field_name in find_template_filters(ctx):
+        try:
+            options = parse_filter_options(filter_name)
+        except:
+            continue
+        if options.delayed:
+            continue
+        if options.shuffle and not options.order:
+            sample_keys[(filter_name, field_name)] = get_sample_key(
+                ctx, filter_name, field_name
+            )
+        groups.setdefault(
+            (options.notetype_name, options.use_other_col, options.materialize), []
+        ).append((filter_name, field_name, options))
+
+    prefetched: Dict[
+        Tuple[str, str],
+        List[Tuple["Future[List[Tuple[str, CopyAroundRelated]]]", int]],
+    ] = {}
+    for (notetype_name, _, _), filters in groups.items():
+        if len(filters) < 2:
+            continue
+        queries = [
+            RelatedQuery(
+                field_name,
+                options.search_in,
+                options.leech_from,
+                options.count,
+                options.shuffle,
+                options.subs2srs_info,
+                options.match,
+                options.order,
+                get_filter_seed(
+                    ctx,
+                    sample_keys.get((filter_name, field_name)),
+                    filter_name,
+                    field_name,
+                ),
+                get_sampled_nids(sample_keys.get((filter_name, field_name))),
+                dedupe=options.dedupe,
+                fuzzy=options.fuzzy,
+                deck=options.deck,
+                tag=options.tag,
+                exclude_tag=options.exclude_tag,
+            )
+            for filter_name, field_name, options in filters
+        ]
+        options = filters[0][2]
+        fut = get_related_many_async(
+            ctx.note(),
+            notetype_name,
+            queries,
+            get_other_col(options),
+            get_link_table(options),
+        )
+        for i, (filter_name, field_name, _) in enumerate(filters):
+            prefetched.setdefault((filter_name, field_name), []).append((fut, i))
+    return prefetched
+
+
+def get_filter_data(
+    ctx: TemplateRenderContext,
+    field_name: str,
+    options: FilterOptions,
+    save_info: SaveInfo,
+    sample_key: Optional[Tuple[int, int, str, str]],
+    seed: int,
+) -> Dict[str, Any]:
+    """Return the options used to look up the filter's results when its buttons are clicked."""
+    return dict(
+        toggle_id=save_info.filter_id,
+        cid=ctx.card().id,
+        notetype_name=options.notetype_name,
+        search_field=field_name,
+        search_in_field=options.search_in,
+        copy_from_fields=options.leech_from,
+        max_notes=options.count,
+        shuffle=options.shuffle,
+        highlight=options.highlight,
+        cloze=options.cloze,
+        subs2srs_info=dataclasses.asdict(options.subs2srs_info)
+        if options.subs2srs_info
+        else {},
+        # FIXME: this should be the side where the filter was included,
+        # but I don't know of a way to get that kind of info here
+        side="a",
+        save_info=dataclasses.asdict(save_info),
+        use_other_col=options.use_other_col,
+        materialize=options.materialize,
+        match=options.match,
+        order=options.order,
+        thumbnails=options.thumbnails,
+        more=options.more,
+        dedupe=options.dedupe,
+        fuzzy=options.fuzzy,
+        deck=options.deck,
+        tag=options.tag,
+        exclude_tag=options.exclude_tag,
+        sample_key=sample_key,
+        seed=seed,
+    )
+
+
+def get_more_button(stored: StoredResults, rel: CopyAroundRelated) -> str:
+    """Return a button loading the page of results following `rel`, if there is one."""
+    stored.cursor = rel.cursor
+    if not stored.spec["more"] or not rel.cursor:
+        return ""
+    return MORE_BUTTON.format(
+        toggle_id=stored.spec["toggle_id"],
+        cmd=consts.FILTER_NAME,
+        label=MORE_LABEL,
+    )
+
+
+def add_filter(
+    field_text: str,
+    field_name: str,
+    filter_name: str,
+    ctx: TemplateRenderContext,
+) -> str:
+
+    if not filter_name.startswith(consts.FILTER_NAME):
+        return field_text
+
+    context = get_active_card_view_context()
+    if consts.FILTER_NAME not in ctx.extra_state:
+        # Reset the stored results of the webview at render time of each card
+        ctx.extra_state[consts.FILTER_NAME] = RESULTS_STORE.reset(context.web)
+        ctx.extra_state[RENDER_START_STATE_KEY] = time.monotonic()
+        # the card layout screen renders templates that aren't saved yet,
+        # so their filters are only known as they're rendered
+        if not isinstance(QApplication.activeModalWidget(), CardLayout):
+            ctx.extra_state[PREFETCHED_STATE_KEY] = prefetch_template_filters(ctx)
+    filter_context: List[StoredResults] = ctx.extra_state[consts.FILTER_NAME]
+    filter_id = len(filter_context)
+
+    options = parse_filter_options(filter_name)
+    save_info = SaveInfo(options.save_field, filter_id)
+    sample_key = None
+    if options.shuffle and not options.order:
+        sample_key = get_sample_key(ctx, filter_name, field_name)
+    seed = get_filter_seed(ctx, sample_key, filter_name, field_name)
+    stored = StoredResults(
+        options.notetype_name,
+        options.leech_from,
+        options.subs2srs_info,
+        options.use_other_col,
+        get_filter_data(ctx, field_name, options, save_info, sample_key, seed),
+    )
+    filter_context.append(stored)
+    if options.delayed:
         ret = TOGGLE_BUTTON.format(
             toggle_id=filter_id,
+            mark=MARK_TOGGLE_JS.replace("\n", " "),
             cmd=consts.FILTER_NAME,
-            data=data_json,
-            label=label,
+            label=options.label,
             shortcut=TRIGGER_FILTER_BUTTON_SHORTCUT,
         )
-        FILTER_CONTEXT.append(CopyAroundRelated(ctx.note().id, {}))
     else:
-        other_col = None
-        if use_other_col:
-            other_col = mw.copyaround_colman.col
-        ret, rel = get_related_content(
-            ctx.note(),
-            notetype_name,
-            field_name,
-            search_in,
-            leech_from,
-            count,
-            shuffle,
-            highlight,
-            cloze,
-            delayed,
-            subs2srs_info,
-            context.card,
-            side="a",
-            save_info=save_info,
-            other_col=other_col,
+        thumbnails = get_thumbnail_cache(options)
+
+        def format_results(
+            result: Tuple[str, CopyAroundRelated]
+        ) -> Tuple[str, CopyAroundRelated, str]:
+            search_text, rel = result
+            copied = format_related(
+                search_text,
+                rel,
+                options.highlight,
+                options.cloze,
+                options.delayed,
+                context.card,
+                side="a",
+                save_info=save_info,
+                thumbnails=thumbnails,
+            )
+            return search_text, rel, copied
+
+        prefetched = ctx.extra_state.get(PREFETCHED_STATE_KEY, {}).get(
+            (filter_name.strip(), field_name.strip())
         )
-        FILTER_CONTEXT.append(rel)
-
-    ctx.extra_state[consts.FILTER_NAME] = FILTER_CONTEXT
+        if prefetched:
+            lookup, i = prefetched.pop(0)
+            fut = then(lookup, lambda results: format_results(results[i]))
+        else:
+            lookup = get_related_async(
+                ctx.note(),
+                options.notetype_name,
+                field_name,
+                options.search_in,
+                options.leech_from,
+                options.count,
+                options.shuffle,
+                options.subs2srs_info,
+                get_other_col(options),
+                get_link_table(options),
+                options.match,
+                options.order,
+                seed,
+                get_sampled_nids(sample_key),
+                dedupe=options.dedupe,
+                fuzzy=options.fuzzy,
+                deck=options.deck,
+                tag=options.tag,
+                exclude_tag=options.exclude_tag,
+            )
+            fut = then(lookup, format_results)
+        timeout = None
+        if options.budget > 0:
+            # filters share the budget, so several slow ones don't delay the card further
+            deadline = ctx.extra_state[RENDER_START_STATE_KEY] + options.budget / 1000
+            timeout = max(0.0, deadline - time.monotonic())
+        try:
+            _, rel, ret = fut.result(timeout=timeout)
+        except FutureTimeoutError:
+            # the rest of the card is shown without waiting for the results
+            show_when_done(fut, context, filter_context, stored, options, sample_key)
+            return PENDING_PLACEHOLDER.format(
+                toggle_id=filter_id, label=LOADING_LABEL, cmd=consts.FILTER_NAME
+            )
+        ret += store_results(stored, rel, sample_key)
 
     return ret
 
 
-def show_copyaround_contents(data: str) -> None:
-    context = get_active_card_view_context()
+def then(fut: Future, func: Callable[[Any], Any]) -> Future:
+    """Return a future of the result of `func` called with the result of `fut`.
+    `func` is called by the thread completing `fut`, so it also runs in the background."""
+    chained: Future = Future()
+
+    def on_done(fut: Future) -> None:
+        try:
+            chained.set_result(func(fut.result()))
+        except BaseException as exc:
+            chained.set_exception(exc)
+
+    fut.add_done_callback(on_done)
+    return chained
+
+
+def store_results(
+    stored: StoredResults,
+    rel: CopyAroundRelated,
+    sample_key: Optional[Tuple[int, int, str, str]],
+) -> str:
+    """Keep the results of a filter for its buttons and return its more button."""
+    remember_sample(sample_key, rel)
+    more_button = get_more_button(stored, rel)
+    stored.add(collection_manager.col if stored.use_other_col else mw.col, rel)
+    RESULTS_STORE.evict()
+    return more_button
+
+
+def inject_pending_contents(web: AnkiWebView, toggle_id: int, contents: str) -> None:
+    """Replace the placeholder of a filter with its contents if it's shown."""
+    web.eval(
+        f"""
+(() => {{
+    const pending = document.getElementById('copyaround-pending-{toggle_id}');
+    if(pending) {{
+        pending.outerHTML = {json.dumps(contents)};
+    }}
+}})();
+        """
+    )
+
+
+def show_pending_contents(toggle_id: int) -> None:
+    """Called by the placeholder of a filter each time it's shown, e.g. on the answer side through {{FrontSide}}."""
+    web = get_active_card_view_context().web
+    filter_context = RESULTS_STORE.get(web)
+    if not filter_context or not 0 <= toggle_id < len(filter_context):
+        return
+    contents = filter_context[toggle_id].contents
+    # otherwise the contents are injected by show_when_done() once ready
+    if contents is not None:
+        inject_pending_contents(web, toggle_id, contents)
+
+
+def show_when_done(
+    fut: "Future[Tuple[str, CopyAroundRelated, str]]",
+    context: CardViewContext,
+    filter_context: List[StoredResults],
+    stored: StoredResults,
+    options: FilterOptions,
+    sample_key: Optional[Tuple[int, int, str, str]],
+) -> None:
+    """Show the results of a filter that ran over its time budget in place of its placeholder once they're ready.
+    They're also kept for the placeholder to request them when it's shown again."""
     web = context.web
-    options = json.loads(data)
-    toggle_id = options["toggle_id"]
+    card = context.card
+    toggle_id = stored.spec["toggle_id"]
+
+    def on_done() -> None:
+        current_card = get_active_card_view_context().card
+        if filter_context is not RESULTS_STORE.get(web) or (
+            current_card and card and current_card.id != card.id
+        ):
+            # stale results
+            return
+        contents = ""
+        try:
+            search_text, rel, contents = fut.result()
+            if playback_controller := getattr(mw, "playback_controller", None):
+                # Anki no longer processes the sound tags of the contents,
+                # so they're handled like the ones of delayed filters
+                contents = format_related(
+                    search_text,
+                    rel,
+                    options.highlight,
+                    options.cloze,
+                    True,
+                    card,
+                    side="a",
+                    save_info=SaveInfo(**stored.spec["save_info"]),
+                    thumbnails=get_thumbnail_cache(options),
+                )
+                if card:
+                    playback_controller.apply_to_card_avtags(card)
+            contents += store_results(stored, rel, sample_key)
+        finally:
+            stored.contents = contents
+            inject_pending_contents(web, toggle_id, contents)
+
+    fut.add_done_callback(lambda fut: mw.taskman.run_on_main(on_done))
+
+
+def get_content_options(
+    spec: Dict[str, Any], context: CardViewContext
+) -> Dict[str, Any]:
+    """Convert the stored options of a filter to arguments of get_related_content()."""
+    options = dict(spec)
     del options["toggle_id"]
+    del options["more"]
+    del options["sample_key"]
+    options["delayed"] = True
+    # FIXME: cause errors if the note was not written to the database yet (e.g. in the card layouts screen opened from the add screen)
+    note = context.note
+    card = context.card if context.card else note.cards()[context.card_ord]
+    options["card"] = card
+    options["note"] = note
+    del options["cid"]
+    if options["subs2srs_info"]:
+        options["subs2srs_info"] = Subs2srsOptions(**options["subs2srs_info"])
+    options["save_info"] = SaveInfo(**options["save_info"])
+    other_col = None
+    if options["use_other_col"]:
+        other_col = collection_manager.col
+    del options["use_other_col"]
+    options["other_col"] = other_col
+    link_table = None
+    if options["materialize"]:
+        link_table = link_table_manager.table
+    del options["materialize"]
+    options["link_table"] = link_table
+    options["thumbnails"] = THUMBNAIL_CACHE if options["thumbnails"] else None
+    return options
+
+
+def get_spec_query(spec: Dict[str, Any]) -> RelatedQuery:
+    sample_key = tuple(spec["sample_key"]) if spec["sample_key"] else None
+    return RelatedQuery(
+        spec["search_field"],
+        spec["search_in_field"],
+        spec["copy_from_fields"],
+        spec["max_notes"],
+        spec["shuffle"],
+        Subs2srsOptions(**spec["subs2srs_info"]) if spec["subs2srs_info"] else None,
+        spec["match"],
+        spec["order"],
+        spec["seed"],
+        get_sampled_nids(sample_key),
+        dedupe=spec["dedupe"],
+        fuzzy=spec["fuzzy"],
+        deck=spec["deck"],
+        tag=spec["tag"],
+        exclude_tag=spec["exclude_tag"],
+    )
 
-    def show(rendered: bool) -> None:
-        if rendered:
-            return
-        options["delayed"] = True
-        # FIXME: cause errors if the note was not written to the database yet (e.g. in the card layouts screen opened from the add screen)
-        note = context.note
-        card = context.card if context.card else note.cards()[context.card_ord]
-        options["card"] = card
-        options["note"] = note
-        del options["cid"]
-        if options["subs2srs_info"]:
-            options["subs2srs_info"] = Subs2srsOptions(**options["subs2srs_info"])
-        options["save_info"] = SaveInfo(**options["save_info"])
-        other_col = None
-        if options["use_other_col"]:
-            other_col = mw.copyaround_colman.col
-        del options["use_other_col"]
-        options["other_col"] = other_col
-        contents, rel = get_related_content(**options)
-        FILTER_CONTEXT[options["save_info"].filter_id] = rel
-        if playback_controller := getattr(mw, "playback_controller", None):
-            playback_controller.apply_to_card_avtags(card)
-        web.eval(
-            f"""
+
+def get_filters_contents(
+    note: Note,
+    card: Card,
+    specs: Dict[int, Dict[str, Any]],
+    queries: Dict[int, RelatedQuery],
+) -> Dict[int, Tuple[str, CopyAroundRelated]]:
+    """Look up and format the results of several filters, keyed by filter ID.
+    Filters searching the same notetype share a single query."""
+    groups: Dict[Tuple[str, bool, bool], List[int]] = {}
+    for toggle_id, spec in specs.items():
+        groups.setdefault(
+            (spec["notetype_name"], spec["use_other_col"], spec["materialize"]), []
+        ).append(toggle_id)
+    contents = {}
+    for (notetype_name, use_other_col, materialize), toggle_ids in groups.items():
+        results = get_related_many(
+            note,
+            notetype_name,
+            [queries[toggle_id] for toggle_id in toggle_ids],
+            collection_manager.col if use_other_col else None,
+            link_table_manager.table if materialize else None,
+        )
+        for toggle_id, (search_text, rel) in zip(toggle_ids, results):
+            spec = specs[toggle_id]
+            copied = format_related(
+                search_text,
+                rel,
+                spec["highlight"],
+                spec["cloze"],
+                True,
+                card,
+                spec["side"],
+                SaveInfo(**spec["save_info"]),
+                THUMBNAIL_CACHE if spec["thumbnails"] else None,
+            )
+            contents[toggle_id] = (copied, rel)
+    return contents
+
+
+def inject_toggle_contents(web: AnkiWebView, contents: Dict[int, str]) -> None:
+    """Insert the contents of each toggle after it, in a single call."""
+    web.eval(
+        f"""
 (() => {{
-    var copyAroundToggle = document.getElementById('copyaround-toggle-{toggle_id}');
-    copyAroundToggle.insertAdjacentHTML('afterend', {json.dumps(contents)});
+    const contents = {json.dumps(contents)};
+    for(const [toggleId, html] of Object.entries(contents)) {{
+        const copyAroundToggle = document.getElementById('copyaround-toggle-' + toggleId);
+        if(copyAroundToggle) {{
+            copyAroundToggle.textContent = copyAroundToggle.dataset.label;
+            copyAroundToggle.disabled = false;
+            copyAroundToggle.insertAdjacentHTML('afterend', html);
+        }}
+    }}
 }})();
-            """
-        )
+        """
+    )
 
-    web.evalWithCallback(
-        f"""
+
+def show_copyaround_contents(toggle_ids: List[int]) -> None:
+    context = get_active_card_view_context()
+    web = context.web
+    # The stored results are replaced on each render, so this tells us whether the card was re-rendered in the meantime
+    filter_context = RESULTS_STORE.get(web)
+    specs = {
+        toggle_id: filter_context[toggle_id].spec
+        for toggle_id in toggle_ids
+        if filter_context and 0 <= toggle_id < len(filter_context)
+    }
+    if not specs:
+        inject_toggle_contents(web, {toggle_id: "" for toggle_id in toggle_ids})
+        return
+    # FIXME: cause errors if the note was not written to the database yet (e.g. in the card layouts screen opened from the add screen)
+    note = context.note
+    card = context.card if context.card else note.cards()[context.card_ord]
+    # sampled notes are read from the cache on the main thread
+    queries = {toggle_id: get_spec_query(spec) for toggle_id, spec in specs.items()}
+
+    def on_done(fut: Future) -> None:
+        current_card = get_active_card_view_context().card
+        if filter_context is not RESULTS_STORE.get(web) or (
+            current_card and current_card.id != card.id
+        ):
+            # stale results
+            return
+        contents = {toggle_id: "" for toggle_id in toggle_ids}
+        try:
+            for toggle_id, (copied, rel) in fut.result().items():
+                stored = filter_context[toggle_id]
+                sample_key = stored.spec["sample_key"]
+                remember_sample(tuple(sample_key) if sample_key else None, rel)
+                stored.add(
+                    collection_manager.col if stored.use_other_col else mw.col, rel
+                )
+                contents[toggle_id] = copied + get_more_button(stored, rel)
+            RESULTS_STORE.evict()
+            if playback_controller := getattr(mw, "playback_controller", None):
+                playback_controller.apply_to_card_avtags(card)
+        finally:
+            inject_toggle_contents(web, contents)
+
+    mw.taskman.run_in_background(
+        lambda: get_filters_contents(note, card, specs, queries), on_done=on_done
+    )
+
+
+def show_more_contents(toggle_id: int) -> None:
+    context = get_active_card_view_context()
+    web = context.web
+    filter_context = RESULTS_STORE.get(web)
+    if not filter_context or not 0 <= toggle_id < len(filter_context):
+        return
+    stored = filter_context[toggle_id]
+    options = get_content_options(stored.spec, context)
+    card = options["card"]
+    options["after"] = stored.cursor
+
+    def on_done(fut: Future) -> None:
+        current_card = get_active_card_view_context().card
+        if filter_context is not RESULTS_STORE.get(web) or (
+            current_card and current_card.id != card.id
+        ):
+            # stale results
+            return
+        contents = ""
+        more_button = ""
+        try:
+            contents, rel = fut.result()
+            # keep all pages available to the add button
+            stored.add(options["other_col"] or mw.col, rel)
+            RESULTS_STORE.evict()
+            more_button = get_more_button(stored, rel)
+            if playback_controller := getattr(mw, "playback_controller", None):
+                playback_controller.apply_to_card_avtags(card)
+        finally:
+            web.eval(
+                f"""
 (() => {{
-    var copyAroundToggle = document.getElementById('copyaround-toggle-{toggle_id}');
-    if(!copyAroundToggle.dataset.rendered) {{
-        copyAroundToggle.dataset.rendered = true;
-        return false;
-    }} else {{
-        return true;
+    var copyAroundMore = document.getElementById('copyaround-more-{toggle_id}');
+    if(copyAroundMore) {{
+        copyAroundMore.insertAdjacentHTML('beforebegin', {json.dumps(contents)});
+        copyAroundMore.outerHTML = {json.dumps(more_button)};
     }}
-}})();""",
-        show,
+}})();
+                """
+            )
+
+    mw.taskman.run_in_background(
+        lambda: get_related_content(**options), on_done=on_done
     )
 
 
@@ -248,7 +878,15 @@ def save_related_note(nid: str, filter_id: int, save_field: str) -> None:
             Please change the save_field option of the {consts.FILTER_NAME} filter from the templates screen."""
         )
         return
-    related_note = FILTER_CONTEXT[filter_id].related_notes[NoteId(int(nid))]
+    filter_context = RESULTS_STORE.get(context.web)
+    if not filter_context or filter_id >= len(filter_context):
+        return
+    stored = filter_context[filter_id]
+    other_col = collection_manager.col if stored.use_other_col else None
+    related_note = stored.related_note(other_col or mw.col, NoteId(int(nid)), other_col)
+    if not related_note:
+        return
+    copy_note_media(related_note)
     note[save_field] += format_note_for_saving(related_note)
     tooltip(f'Added content from note {nid} to field "{save_field}"')
     if note.id:
@@ -263,9 +901,12 @@ def handle_js_msg(
     if not message.startswith(consts.FILTER_NAME):
         return handled
     _, subcmd, data = message.split(":", maxsplit=2)
-    data = data.replace("&quot;", '"')
     if subcmd == "show":
-        show_copyaround_contents(data)
+        show_copyaround_contents([int(i) for i in data.split(",") if i])
+    elif subcmd == "more":
+        show_more_contents(int(data))
+    elif subcmd == "pending":
+        show_pending_contents(int(data))
     elif subcmd == "add":
         nid, filter_id, save_field = data.split(":")
         save_related_note(nid, int(filter_id), save_field)
@@ -274,24 +915,18 @@ def handle_js_msg(
 
 def on_show_hotkey_triggered() -> None:
     web = get_active_card_view_context().web
+    # all toggles are revealed with a single message
     web.eval(
-        """
-(() => {
-    const copyAroundToggles = document.getElementsByClassName('copyaround-toggle');
-    for(const toggle of copyAroundToggles) {
-        toggle.click();
-    }
-})();""",
+        f"""
+(() => {{
+    const toggleIds = [];
+    for(const toggle of document.getElementsByClassName('copyaround-toggle')) {{
+        if(((toggle) => {{{MARK_TOGGLE_JS}}})(toggle)) {{
+            toggleIds.push(toggle.dataset.toggleId);
+        }}
+    }}
+    if(toggleIds.length) {{
+        pycmd('{consts.FILTER_NAME}:show:' + toggleIds.join(','));
+    }}
+}})();""",
     )
-
-
-def modify_replay_shortcut(state: str, shortcuts: List[Tuple[str, Callable]]) -> None:
-    if state != "review":
-        return
-    shortcuts.append((TRIGGER_FILTER_BUTTON_SHORTCUT, on_show_hotkey_triggered))
-
-
-def init_filter() -> None:
-    field_filter.append(add_filter)
-    webview_did_receive_js_message.append(handle_js_msg)
-    state_shortcuts_will_change.append(modify_replay_shortcut)
@@ -0,0 +1,72 @@
+"""Hooks of the template filter.
+
+The filter module pulls in the query engine, so it's only imported once a card using the filter
+is rendered or one of its buttons is clicked, keeping the add-on's startup cheap.
+"""
+
+import sys
+from types import ModuleType
+from typing import Any, Callable, List, Tuple
+
+from anki.hooks import field_filter
+from anki.template import TemplateRenderContext
+from aqt.gui_hooks import (
+    state_did_change,
+    state_shortcuts_will_change,
+    webview_did_receive_js_message,
+)
+
+from . import consts
+
+FILTER_MODULE = f"{__name__.rpartition('.')[0]}.filter"
+
+
+def _filter_module() -> ModuleType:
+    from . import filter as filter_module
+
+    return filter_module
+
+
+def add_filter(
+    field_text: str,
+    field_name: str,
+    filter_name: str,
+    ctx: TemplateRenderContext,
+) -> str:
+    if not filter_name.startswith(consts.FILTER_NAME):
+        return field_text
+    return _filter_module().add_filter(field_text, field_name, filter_name, ctx)
+
+
+def handle_js_msg(
+    handled: Tuple[bool, Any], message: str, context: Any
+) -> Tuple[bool, Any]:
+    if not message.startswith(consts.FILTER_NAME):
+        return handled
+    return _filter_module().handle_js_msg(handled, message, context)
+
+
+def on_show_hotkey_triggered() -> None:
+    _filter_module().on_show_hotkey_triggered()
+
+
+def modify_replay_shortcut(state: str, shortcuts: List[Tuple[str, Callable]]) -> None:
+    if state != "review":
+        return
+    shortcuts.append(
+        (consts.CONFIG["trigger_filter_button_shortcut"], on_show_hotkey_triggered)
+    )
+
+
+def on_state_did_change(new_state: str, old_state: str) -> None:
+    # there are no samples to reset before the filter is used
+    filter_module = sys.modules.get(FILTER_MODULE)
+    if filter_module:
+        filter_module.on_state_did_change(new_state, old_state)
+
+
+def init_filter() -> None:
+    field_filter.append(add_filter)
+    webview_did_receive_js_message.append(handle_js_msg)
+    state_shortcuts_will_change.append(modify_replay_shortcut)
+    state_did_change.append(on_state_did_change)
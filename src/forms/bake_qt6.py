@@ -0,0 +1,55 @@
+# Form implementation generated from reading ui file 'designer/bake.ui'
+#
+# Created by: PyQt6 UI code generator 6.2.3
+#
+# WARNING: Any manual changes made to this file will be lost when pyuic6 is
+# run again.  Do not edit this file unless you know what you are doing.
+
+
+from PyQt6 import QtCore, QtGui, QtWidgets
+
+
+class Ui_Dialog(object):
+    def setupUi(self, Dialog):
+        Dialog.setObjectName("Dialog")
+        Dialog.resize(512, 180)
+        self.formLayout = QtWidgets.QFormLayout(Dialog)
+        self.formLayout.setObjectName("formLayout")
+        self.label = QtWidgets.QLabel(Dialog)
+        self.label.setObjectName("label")
+        self.formLayout.setWidget(0, QtWidgets.QFormLayout.ItemRole.LabelRole, self.label)
+        self.filterComboBox = QtWidgets.QComboBox(Dialog)
+        self.filterComboBox.setEditable(True)
+        self.filterComboBox.setObjectName("filterComboBox")
+        self.formLayout.setWidget(0, QtWidgets.QFormLayout.ItemRole.FieldRole, self.filterComboBox)
+        self.label_2 = QtWidgets.QLabel(Dialog)
+        self.label_2.setObjectName("label_2")
+        self.formLayout.setWidget(1, QtWidgets.QFormLayout.ItemRole.LabelRole, self.label_2)
+        self.targetFieldComboBox = QtWidgets.QComboBox(Dialog)
+        self.targetFieldComboBox.setObjectName("targetFieldComboBox")
+        self.formLayout.setWidget(1, QtWidgets.QFormLayout.ItemRole.FieldRole, self.targetFieldComboBox)
+        self.label_3 = QtWidgets.QLabel(Dialog)
+        self.label_3.setObjectName("label_3")
+        self.formLayout.setWidget(2, QtWidgets.QFormLayout.ItemRole.LabelRole, self.label_3)
+        self.notesComboBox = QtWidgets.QComboBox(Dialog)
+        self.notesComboBox.setObjectName("notesComboBox")
+        self.formLayout.setWidget(2, QtWidgets.QFormLayout.ItemRole.FieldRole, self.notesComboBox)
+        self.incrementalCheckBox = QtWidgets.QCheckBox(Dialog)
+        self.incrementalCheckBox.setChecked(True)
+        self.incrementalCheckBox.setObjectName("incrementalCheckBox")
+        self.formLayout.setWidget(3, QtWidgets.QFormLayout.ItemRole.SpanningRole, self.incrementalCheckBox)
+        self.bakeButton = QtWidgets.QPushButton(Dialog)
+        self.bakeButton.setObjectName("bakeButton")
+        self.formLayout.setWidget(4, QtWidgets.QFormLayout.ItemRole.FieldRole, self.bakeButton)
+
+        self.retranslateUi(Dialog)
+        QtCore.QMetaObject.connectSlotsByName(Dialog)
+
+    def retranslateUi(self, Dialog):
+        _translate = QtCore.QCoreApplication.translate
+        Dialog.setWindowTitle(_translate("Dialog", "Dialog"))
+        self.label.setText(_translate("Dialog", "Filter to bake"))
+        self.label_2.setText(_translate("Dialog", "Field to bake into"))
+        self.label_3.setText(_translate("Dialog", "Notes to bake"))
+        self.incrementalCheckBox.setText(_translate("Dialog", "Skip notes that didn\'t change since they were last baked"))
+        self.bakeButton.setText(_translate("Dialog", "Bake"))
@@ -48,7 +48,7 @@ class Ui_Dialog(object):
         self.formLayout_2.setWidget(6, QtWidgets.QFormLayout.FieldRole, self.matchedNotesSpinBox)
         self.copyButton = QtWidgets.QPushButton(Dialog)
         self.copyButton.setObjectName("copyButton")
-        self.formLayout_2.setWidget(8, QtWidgets.QFormLayout.FieldRole, self.copyButton)
+        self.formLayout_2.setWidget(13, QtWidgets.QFormLayout.FieldRole, self.copyButton)
         self.searchInFieldCheckBox = QtWidgets.QCheckBox(Dialog)
         self.searchInFieldCheckBox.setObjectName("searchInFieldCheckBox")
         self.formLayout_2.setWidget(3, QtWidgets.QFormLayout.LabelRole, self.searchInFieldCheckBox)
@@ -63,6 +63,50 @@ class Ui_Dialog(object):
         self.copyFromListWidget.setSelectionMode(QtWidgets.QAbstractItemView.ExtendedSelection)
         self.copyFromListWidget.setObjectName("copyFromListWidget")
         self.formLayout_2.setWidget(4, QtWidgets.QFormLayout.FieldRole, self.copyFromListWidget)
+        self.exactMatchCheckBox = QtWidgets.QCheckBox(Dialog)
+        self.exactMatchCheckBox.setObjectName("exactMatchCheckBox")
+        self.formLayout_2.setWidget(5, QtWidgets.QFormLayout.SpanningRole, self.exactMatchCheckBox)
+        self.label_7 = QtWidgets.QLabel(Dialog)
+        self.label_7.setObjectName("label_7")
+        self.formLayout_2.setWidget(8, QtWidgets.QFormLayout.LabelRole, self.label_7)
+        self.orderComboBox = QtWidgets.QComboBox(Dialog)
+        self.orderComboBox.setObjectName("orderComboBox")
+        self.formLayout_2.setWidget(8, QtWidgets.QFormLayout.FieldRole, self.orderComboBox)
+        self.fuzzyMatchCheckBox = QtWidgets.QCheckBox(Dialog)
+        self.fuzzyMatchCheckBox.setObjectName("fuzzyMatchCheckBox")
+        self.formLayout_2.setWidget(9, QtWidgets.QFormLayout.LabelRole, self.fuzzyMatchCheckBox)
+        self.fuzzyMatchSpinBox = QtWidgets.QSpinBox(Dialog)
+        self.fuzzyMatchSpinBox.setEnabled(False)
+        self.fuzzyMatchSpinBox.setMinimum(1)
+        self.fuzzyMatchSpinBox.setMaximum(3)
+        self.fuzzyMatchSpinBox.setObjectName("fuzzyMatchSpinBox")
+        self.formLayout_2.setWidget(9, QtWidgets.QFormLayout.FieldRole, self.fuzzyMatchSpinBox)
+        self.label_8 = QtWidgets.QLabel(Dialog)
+        self.label_8.setObjectName("label_8")
+        self.formLayout_2.setWidget(10, QtWidgets.QFormLayout.LabelRole, self.label_8)
+        self.deckComboBox = QtWidgets.QComboBox(Dialog)
+        self.deckComboBox.setObjectName("deckComboBox")
+        self.formLayout_2.setWidget(10, QtWidgets.QFormLayout.FieldRole, self.deckComboBox)
+        self.label_9 = QtWidgets.QLabel(Dialog)
+        self.label_9.setObjectName("label_9")
+        self.formLayout_2.setWidget(11, QtWidgets.QFormLayout.LabelRole, self.label_9)
+        self.tagLineEdit = QtWidgets.QLineEdit(Dialog)
+        self.tagLineEdit.setObjectName("tagLineEdit")
+        self.formLayout_2.setWidget(11, QtWidgets.QFormLayout.FieldRole, self.tagLineEdit)
+        self.label_10 = QtWidgets.QLabel(Dialog)
+        self.label_10.setObjectName("label_10")
+        self.formLayout_2.setWidget(12, QtWidgets.QFormLayout.LabelRole, self.label_10)
+        self.excludeTagLineEdit = QtWidgets.QLineEdit(Dialog)
+        self.excludeTagLineEdit.setObjectName("excludeTagLineEdit")
+        self.formLayout_2.setWidget(12, QtWidgets.QFormLayout.FieldRole, self.excludeTagLineEdit)
+        self.incrementalCheckBox = QtWidgets.QCheckBox(Dialog)
+        self.incrementalCheckBox.setObjectName("incrementalCheckBox")
+        self.formLayout_2.setWidget(13, QtWidgets.QFormLayout.LabelRole, self.incrementalCheckBox)
+        self.previewBrowser = QtWidgets.QTextBrowser(Dialog)
+        self.previewBrowser.setMinimumSize(QtCore.QSize(0, 120))
+        self.previewBrowser.setOpenLinks(False)
+        self.previewBrowser.setObjectName("previewBrowser")
+        self.formLayout_2.setWidget(14, QtWidgets.QFormLayout.SpanningRole, self.previewBrowser)
 
         self.retranslateUi(Dialog)
         QtCore.QMetaObject.connectSlotsByName(Dialog)
@@ -82,3 +126,13 @@ class Ui_Dialog(object):
         self.copyButton.setText(_translate("Dialog", "Copy"))
         self.searchInFieldCheckBox.setText(_translate("Dialog", "Field to search in"))
         self.randomizeCheckBox.setText(_translate("Dialog", "Randomize results"))
+        self.exactMatchCheckBox.setText(_translate("Dialog", "Match whole field exactly"))
+        self.label_7.setText(_translate("Dialog", "Order results by"))
+        self.fuzzyMatchCheckBox.setText(_translate("Dialog", "Fuzzy match (maximum edits)"))
+        self.label_8.setText(_translate("Dialog", "Deck to search"))
+        self.label_9.setText(_translate("Dialog", "Tags to include"))
+        self.tagLineEdit.setPlaceholderText(_translate("Dialog", "comma-separated, any of them"))
+        self.label_10.setText(_translate("Dialog", "Tags to exclude"))
+        self.excludeTagLineEdit.setPlaceholderText(_translate("Dialog", "comma-separated"))
+        self.incrementalCheckBox.setToolTip(_translate("Dialog", "Only process notes whose search text, options or searched notes changed since the last run"))
+        self.incrementalCheckBox.setText(_translate("Dialog", "Skip unchanged notes"))
@@ -0,0 +1,248 @@
+import re
+import threading
+import time
+import unicodedata
+from array import array
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+from anki.collection import Collection
+from anki.notes import NoteId
+from anki.utils import ids2str
+
+HTML_TAG_RE = re.compile(r"<[^>]*>")
+SOUND_TAG_RE = re.compile(r"\[sound:[^]]*\]")
+TOKEN_RE = re.compile(r"\w+")
+# Scripts written without spaces between words
+UNSPACED_RE = re.compile(r"[぀-ヿ㐀-䶿一-鿿가-힯]")
+# Maximum supported edit distance
+MAX_DISTANCE = 3
+# Minimum number of seconds between checks of whether an index is outdated
+INDEX_CHECK_INTERVAL = 30
+# Maximum number of cached indexes
+MAX_INDEXES = 4
+# Minimum number of characters of each part of an unspaced search text
+MIN_PART_LENGTH = 2
+# Maximum number of notes checked against an unspaced search text
+MAX_CANDIDATES = 1000
+
+
+def normalize_text(text: str) -> str:
+    text = SOUND_TAG_RE.sub(" ", HTML_TAG_RE.sub(" ", text))
+    return unicodedata.normalize("NFKC", text).casefold()
+
+
+def edit_distance(a: str, b: str, max_distance: int) -> int:
+    """Return the Levenshtein distance of `a` and `b`, or `max_distance + 1` if it's larger."""
+    if abs(len(a) - len(b)) > max_distance:
+        return max_distance + 1
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            current.append(
+                min(
+                    previous[j] + 1,
+                    current[j - 1] + 1,
+                    previous[j - 1] + (char_a != char_b),
+                )
+            )
+        if min(current) > max_distance:
+            return max_distance + 1
+        previous = current
+    return previous[-1]
+
+
+def substring_distance(pattern: str, text: str) -> int:
+    """Return the smallest edit distance between `pattern` and any substring of `text`."""
+    # a match can start anywhere in the text, so the first row is all zeros
+    previous = [0] * (len(text) + 1)
+    for i, char_p in enumerate(pattern, 1):
+        current = [i]
+        for j, char_t in enumerate(text, 1):
+            current.append(
+                min(
+                    previous[j] + 1,
+                    current[j - 1] + 1,
+                    previous[j - 1] + (char_p != char_t),
+                )
+            )
+        previous = current
+    return min(previous)
+
+
+class BKTree:
+    """A metric tree of words, finding the words within an edit distance of a query
+    without comparing it to every word."""
+
+    def __init__(self) -> None:
+        # each node is a (word, children by distance to the word) pair
+        self.root: Optional[Tuple[str, Dict[int, tuple]]] = None
+
+    def add(self, word: str) -> None:
+        if not self.root:
+            self.root = (word, {})
+            return
+        node = self.root
+        while True:
+            # words never differ by more than their longest length
+            distance = edit_distance(word, node[0], max(len(word), len(node[0])))
+            if distance == 0:
+                return
+            child = node[1].get(distance)
+            if not child:
+                node[1][distance] = (word, {})
+                return
+            node = child
+
+    def search(self, word: str, max_distance: int) -> Iterator[str]:
+        """Yield the words within `max_distance` edits of `word`."""
+        if not self.root:
+            return
+        stack = [self.root]
+        while stack:
+            node_word, children = stack.pop()
+            distance = edit_distance(word, node_word, max(len(word), len(node_word)))
+            if distance <= max_distance:
+                yield node_word
+            # by the triangle inequality, only these subtrees can contain matches
+            for child_distance, child in children.items():
+                if abs(child_distance - distance) <= max_distance:
+                    stack.append(child)
+
+
+class FuzzyIndex:
+    """The words of a field of a notetype's notes, with the notes containing each word.
+
+    Words of scripts written with spaces are kept in a BK-tree. Text of scripts written without
+    spaces has no word boundaries, so the notes containing each character are kept instead.
+    Candidates of a search are notes containing a part of the search text that no match with
+    up to N edits can miss, which are then checked against the whole search text.
+    """
+
+    def __init__(self, signature: Tuple[int, int]) -> None:
+        self.signature = signature
+        self.checked = time.monotonic()
+        self.tree = BKTree()
+        self.word_postings: Dict[str, "array[int]"] = {}
+        self.char_postings: Dict[str, "array[int]"] = {}
+
+    @classmethod
+    def build(
+        cls, col: Collection, mid: int, ord: int, signature: Tuple[int, int]
+    ) -> "FuzzyIndex":
+        index = cls(signature)
+        for nid, text in col.db.execute(*_field_query(mid, ord)):
+            words = set()
+            chars = set()
+            for token in TOKEN_RE.findall(normalize_text(text)):
+                if UNSPACED_RE.search(token):
+                    chars.update(token)
+                else:
+                    words.add(token)
+            for word in words:
+                nids = index.word_postings.get(word)
+                if nids is None:
+                    nids = index.word_postings[word] = array("q")
+                    index.tree.add(word)
+                nids.append(nid)
+            for char in chars:
+                index.char_postings.setdefault(char, array("q")).append(nid)
+        return index
+
+    def search_words(self, word: str, max_distance: int) -> Set[NoteId]:
+        nids: Set[NoteId] = set()
+        for match in self.tree.search(word, max_distance):
+            nids.update(NoteId(nid) for nid in self.word_postings[match])
+        return nids
+
+    def search_unspaced(
+        self, col: Collection, mid: int, ord: int, text: str, max_distance: int
+    ) -> Set[NoteId]:
+        # N edits can touch at most N of N + 1 parts of the text,
+        # so a match contains all characters of at least one part
+        size = len(text) // (max_distance + 1)
+        candidates: Set[int] = set()
+        for i in range(max_distance + 1):
+            part = text[i * size : (i + 1) * size if i < max_distance else len(text)]
+            postings = [self.char_postings.get(char, ()) for char in set(part)]
+            postings.sort(key=len)
+            nids = set(postings[0])
+            for other in postings[1:]:
+                nids.intersection_update(other)
+            candidates.update(nids)
+            if len(candidates) > MAX_CANDIDATES:
+                # the text is too common, checking every candidate would scan most notes
+                return set()
+        if not candidates:
+            return set()
+        sql, *args = _field_query(mid, ord)
+        return {
+            nid
+            for nid, field_text in col.db.execute(
+                f"{sql} and id in {ids2str(candidates)}", *args
+            )
+            if substring_distance(text, normalize_text(field_text)) <= max_distance
+        }
+
+
+def _field_query(mid: int, ord: int) -> Tuple:
+    if ord < 0:
+        return ("select id, flds from notes where mid = ?", mid)
+    return ("select id, field_at_index(flds, ?) from notes where mid = ?", ord, mid)
+
+
+class FuzzyIndexes:
+    """Fuzzy indexes of the searched fields, built on first use and rebuilt when notes change."""
+
+    def __init__(self) -> None:
+        self._indexes: Dict[Tuple[str, int, int], FuzzyIndex] = {}
+        self._lock = threading.Lock()
+
+    def get(self, col: Collection, mid: int, ord: int) -> FuzzyIndex:
+        key = (col.path, mid, ord)
+        # indexes are built once even when several lookups need them at the same time
+        with self._lock:
+            index = self._indexes.get(key)
+            if index and time.monotonic() - index.checked < INDEX_CHECK_INTERVAL:
+                return index
+            count, mod = col.db.first(
+                "select count(), max(mod) from notes where mid = ?", mid
+            )
+            signature = (count, mod or 0)
+            if index and index.signature == signature:
+                index.checked = time.monotonic()
+                return index
+            index = FuzzyIndex.build(col, mid, ord, signature)
+            self._indexes.pop(key, None)
+            self._indexes[key] = index
+            while len(self._indexes) > MAX_INDEXES:
+                del self._indexes[next(iter(self._indexes))]
+            return index
+
+    def search(
+        self, col: Collection, mid: int, ord: int, text: str, max_distance: int
+    ) -> List[NoteId]:
+        """Return the notes whose field with ordinal `ord` (all fields if negative)
+        contains a word within `max_distance` edits of each word of `text`.
+
+        Text of scripts written without spaces is searched as a whole instead, and nothing
+        is returned when it's too short or common to narrow down the notes to check."""
+        tokens = TOKEN_RE.findall(normalize_text(text))
+        if not tokens:
+            return []
+        max_distance = min(max_distance, MAX_DISTANCE)
+        index = self.get(col, mid, ord)
+        if any(UNSPACED_RE.search(token) for token in tokens):
+            text = "".join(tokens)
+            # shorter parts are contained in too many notes
+            max_distance = max(0, min(max_distance, len(text) // MIN_PART_LENGTH - 1))
+            return sorted(index.search_unspaced(col, mid, ord, text, max_distance))
+        nids: Optional[Set[NoteId]] = None
+        # longer words match fewer notes
+        for token in sorted(set(tokens), key=len, reverse=True):
+            # a word with as many edits as characters matches everything
+            token_nids = index.search_words(token, min(max_distance, len(token) - 1))
+            nids = token_nids if nids is None else nids & token_nids
+            if not nids:
+                return []
+        return sorted(nids or ())
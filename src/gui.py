@@ -0,0 +1,47 @@
+import os
+from typing import Optional
+
+import aqt
+from anki.collection import OpChanges
+from aqt import gui_hooks, mw
+
+from . import consts
+from .bulk import init_hooks
+from .collection_manager import CollectionManager
+from .filter_hooks import init_filter
+from .materialized import LinkTableManager
+from .other_media import register_media_route
+
+collection_manager = CollectionManager()
+link_table_manager = LinkTableManager()
+ANKI_VERSION = tuple(int(p) for p in aqt.appVersion.split("."))
+
+
+def open_other_col() -> None:
+    other_col_name = consts.CONFIG["other_collection_name"]
+    if other_col_name and other_col_name != mw.pm.name:
+        collection_manager.open(other_col_name)
+        if ANKI_VERSION < (2, 1, 50):
+            # work around MediaManager changing working directory and breaking audio playback after we open the other collection
+            # https://github.com/ankitects/anki/pull/1630
+            os.chdir(mw.col.media.dir())
+
+
+def open_link_table() -> None:
+    link_table_manager.open(os.path.join(mw.pm.profileFolder(), "copyaround.db"))
+
+
+def on_operation_did_execute(changes: OpChanges, handler: Optional[object]) -> None:
+    if changes.note_text and link_table_manager.table:
+        link_table_manager.table.on_notes_changed(mw.col)
+
+
+init_hooks()
+init_filter()
+mw.addonManager.setWebExports(__name__, r"user_files/thumbnails/.*")
+register_media_route()
+gui_hooks.profile_did_open.append(open_other_col)
+gui_hooks.profile_did_open.append(open_link_table)
+gui_hooks.operation_did_execute.append(on_operation_did_execute)
+gui_hooks.profile_will_close.append(collection_manager.close)
+gui_hooks.profile_will_close.append(link_table_manager.close)
@@ -0,0 +1,397 @@
+import hashlib
+import json
+import re
+import sqlite3
+import threading
+import unicodedata
+from dataclasses import dataclass
+from typing import Callable, List, Optional, Sequence, Set, Tuple
+
+from anki import hooks
+from anki.collection import Collection
+from anki.notes import Note, NoteId
+from anki.utils import ids2str
+
+try:
+    from anki.utils import strip_html
+except ImportError:
+    from anki.utils import stripHTML as strip_html  # type: ignore
+
+# If more target notes than this changed since the last lookup, it's cheaper
+# to drop the spec's links and let them be recomputed lazily
+MAX_INCREMENTAL_UPDATES = 1000
+
+SCHEMA = """
+create table if not exists specs (
+    id integer primary key,
+    key text not null unique,
+    dst_col text not null,
+    dst_mid integer not null,
+    max_nid integer not null,
+    max_usn integer not null,
+    dirty_seq integer not null
+);
+create table if not exists sources (
+    spec integer not null,
+    nid integer not null,
+    pattern text not null,
+    primary key (spec, nid)
+) without rowid;
+create table if not exists links (
+    spec integer not null,
+    src integer not null,
+    dst integer not null,
+    primary key (spec, src, dst)
+) without rowid;
+create index if not exists ix_links_dst on links (spec, dst);
+create table if not exists dirty (
+    seq integer primary key autoincrement,
+    col text not null,
+    mid integer not null,
+    nid integer not null
+);
+"""
+
+
+def like_to_regex(pattern: str) -> "re.Pattern[str]":
+    """Compile an SQL LIKE pattern using '\\' as the escape character.
+    Case is only folded for ASCII letters to match SQLite's LIKE."""
+    parts = []
+    i = 0
+    while i < len(pattern):
+        c = pattern[i]
+        if c == "\\" and i + 1 < len(pattern):
+            i += 1
+            parts.append(re.escape(pattern[i]))
+        elif c == "%":
+            parts.append(".*")
+        elif c == "_":
+            parts.append(".")
+        else:
+            parts.append(re.escape(c))
+        i += 1
+    return re.compile("".join(parts), re.IGNORECASE | re.ASCII | re.DOTALL)
+
+
+@dataclass
+class LinkSpec:
+    """Describes a filter configuration whose matches are materialized."""
+
+    dst_col: str
+    dst_mid: int
+    # ordinal of the field to search in, or -1 to search in all fields
+    search_in_ord: int
+    copy_from_ords: List[int]
+    search_field: str
+
+    exact: bool = False
+
+    @property
+    def key(self) -> str:
+        data = json.dumps(
+            [
+                self.dst_col,
+                self.dst_mid,
+                self.search_in_ord,
+                self.copy_from_ords,
+                self.search_field,
+                self.exact,
+            ]
+        )
+        return hashlib.sha1(data.encode("utf-8")).hexdigest()
+
+    def compile(self, pattern: str) -> Callable[[str], bool]:
+        """Return a predicate testing a field against a stored search pattern."""
+        if self.exact:
+            return lambda text: (
+                unicodedata.normalize("NFC", strip_html(text)) == pattern
+            )
+        regex = like_to_regex(pattern)
+        return lambda text: regex.search(text) is not None
+
+    def matches(self, test: Callable[[str], bool], sfld: str, flds: str) -> bool:
+        fields = flds.split("\x1f")
+        if self.search_in_ord >= 0:
+            if self.search_in_ord >= len(fields) or not test(
+                fields[self.search_in_ord]
+            ):
+                return False
+        elif self.exact:
+            if not any(test(field) for field in fields):
+                return False
+        elif not (test(sfld) or test(flds)):
+            return False
+        return any(o < len(fields) and fields[o] for o in self.copy_from_ords)
+
+
+class LinkTable:
+    """A sidecar database mapping source notes to the target notes matched by a filter spec.
+
+    Entries of a source note are recomputed when its search text changes.
+    Target notes are tracked incrementally: additions are found past the max note id watermark,
+    synced changes past the max usn watermark (both read from indexes), and local edits via hooks.
+    Only the target notes marked as changed are checked again, so stored links are returned as is.
+    Edits made by the backend alone (e.g. Find & Replace or undo) drop the links into the collection,
+    see on_notes_changed().
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.lock = threading.RLock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.executescript(SCHEMA)
+        self._refresh_watched()
+        # whether notes were saved through the hooks since the last call of on_notes_changed()
+        self._flushed = False
+
+    def close(self) -> None:
+        with self.lock:
+            self.db.commit()
+            self.db.close()
+
+    def _refresh_watched(self) -> None:
+        self.watched: Set[Tuple[str, int]] = set(
+            self.db.execute("select dst_col, dst_mid from specs")
+        )
+
+    def _watermarks(self, col: Collection) -> Tuple[int, int]:
+        # separate queries, so that each maximum is read from an index
+        max_nid = col.db.scalar("select max(id) from notes") or 0
+        max_usn = col.db.scalar("select max(usn) from notes") or 0
+        return max_nid, max_usn
+
+    def _spec_row(self, col: Collection, spec: LinkSpec) -> Tuple[int, int, int, int]:
+        key = spec.key
+        row = self.db.execute(
+            "select id, max_nid, max_usn, dirty_seq from specs where key = ?",
+            (key,),
+        ).fetchone()
+        if row:
+            return row
+        max_nid, max_usn = self._watermarks(col)
+        dirty_seq = self.db.execute("select max(seq) from dirty").fetchone()[0] or 0
+        cur = self.db.execute(
+            "insert into specs (key, dst_col, dst_mid, max_nid, max_usn, dirty_seq) values (?, ?, ?, ?, ?, ?)",
+            (key, spec.dst_col, spec.dst_mid, max_nid, max_usn, dirty_seq),
+        )
+        self._refresh_watched()
+        return cur.lastrowid, max_nid, max_usn, dirty_seq
+
+    def _changed_targets(
+        self, col: Collection, spec: LinkSpec, spec_id: int, row: Tuple[int, ...]
+    ) -> Optional[List[NoteId]]:
+        _, max_nid, max_usn, dirty_seq = row
+        new_max_nid, new_max_usn = self._watermarks(col)
+        new_dirty_seq = self.db.execute("select max(seq) from dirty").fetchone()[0] or 0
+        if (new_max_nid, new_max_usn, new_dirty_seq) == (max_nid, max_usn, dirty_seq):
+            return []
+        changed: Set[NoteId] = set()
+        if new_max_nid > max_nid:
+            changed.update(
+                col.db.list(
+                    "select id from notes where id > ? and mid = ?",
+                    max_nid,
+                    spec.dst_mid,
+                )
+            )
+        if new_max_usn > max_usn:
+            # the unary plus keeps SQLite from preferring the notetype index
+            changed.update(
+                col.db.list(
+                    "select id from notes where usn > ? and +mid = ?",
+                    max_usn,
+                    spec.dst_mid,
+                )
+            )
+        changed.update(
+            nid
+            for (nid,) in self.db.execute(
+                "select nid from dirty where seq > ? and col = ? and mid = ?",
+                (dirty_seq, spec.dst_col, spec.dst_mid),
+            )
+        )
+        self.db.execute(
+            "update specs set max_nid = ?, max_usn = ?, dirty_seq = ? where id = ?",
+            (new_max_nid, new_max_usn, new_dirty_seq, spec_id),
+        )
+        self.db.execute(
+            "delete from dirty where seq <= (select min(dirty_seq) from specs)"
+        )
+        if len(changed) > MAX_INCREMENTAL_UPDATES:
+            return None
+        return list(changed)
+
+    def _update_targets(
+        self, col: Collection, spec: LinkSpec, spec_id: int, nids: List[NoteId]
+    ) -> None:
+        if not nids:
+            return
+        self.db.execute(
+            f"delete from links where spec = ? and dst in {ids2str(nids)}", (spec_id,)
+        )
+        sources = [
+            (src, spec.compile(pattern))
+            for src, pattern in self.db.execute(
+                "select nid, pattern from sources where spec = ?", (spec_id,)
+            )
+        ]
+        new_links = []
+        for nid, sfld, flds in col.db.all(
+            f"select id, sfld, flds from notes where id in {ids2str(nids)} and mid = ?",
+            spec.dst_mid,
+        ):
+            for src, test in sources:
+                if src != nid and spec.matches(test, str(sfld), flds):
+                    new_links.append((spec_id, src, nid))
+        self.db.executemany("insert or ignore into links values (?, ?, ?)", new_links)
+
+    def _reset(self, spec_id: int) -> None:
+        self.db.execute("delete from links where spec = ?", (spec_id,))
+        self.db.execute("delete from sources where spec = ?", (spec_id,))
+
+    def invalidate(self, col: Collection) -> None:
+        """Drop the links into the collection's notes, so that they're recomputed lazily."""
+        with self.lock:
+            for (spec_id,) in self.db.execute(
+                "select id from specs where dst_col = ?", (col.path,)
+            ).fetchall():
+                self._reset(spec_id)
+            self.db.commit()
+
+    def related_nids(
+        self,
+        col: Collection,
+        note: Note,
+        pattern: str,
+        spec: LinkSpec,
+        compute: Callable[[], Sequence[NoteId]],
+        limit: int = -1,
+    ) -> List[NoteId]:
+        """Return the target notes matched by `note` in ID order, computing and storing them first if needed.
+        `col` is the collection of target notes and `compute` runs the full search.
+        Only the first `limit` notes are returned if positive, see links() for the next ones."""
+        with self.lock:
+            row = self._spec_row(col, spec)
+            spec_id = row[0]
+            changed = self._changed_targets(col, spec, spec_id, row)
+            if changed is None:
+                self._reset(spec_id)
+            else:
+                self._update_targets(col, spec, spec_id, changed)
+            stored = self.db.execute(
+                "select pattern from sources where spec = ? and nid = ?",
+                (spec_id, note.id),
+            ).fetchone()
+            if stored and stored[0] == pattern:
+                nids = self._links(spec_id, note.id, NoteId(0), limit)
+            else:
+                nids = sorted(compute())
+                self.db.execute(
+                    "delete from links where spec = ? and src = ?", (spec_id, note.id)
+                )
+                self.db.execute(
+                    "insert or replace into sources values (?, ?, ?)",
+                    (spec_id, note.id, pattern),
+                )
+                self.db.executemany(
+                    "insert or ignore into links values (?, ?, ?)",
+                    ((spec_id, note.id, nid) for nid in nids),
+                )
+                if limit > 0:
+                    nids = nids[:limit]
+            self.db.commit()
+            return nids
+
+    def _links(
+        self, spec_id: int, src: NoteId, after: NoteId, limit: int
+    ) -> List[NoteId]:
+        return [
+            NoteId(nid)
+            for (nid,) in self.db.execute(
+                "select dst from links where spec = ? and src = ? and dst > ? order by dst limit ?",
+                (spec_id, src, after, limit),
+            )
+        ]
+
+    def links(
+        self, spec: LinkSpec, src: NoteId, after: NoteId, limit: int = -1
+    ) -> List[NoteId]:
+        """Return the stored target notes of `src` following `after` in ID order,
+        e.g. to read the links returned by related_nids() a page at a time."""
+        with self.lock:
+            row = self.db.execute(
+                "select id from specs where key = ?", (spec.key,)
+            ).fetchone()
+            return self._links(row[0], src, after, limit) if row else []
+
+    def on_note_will_flush(self, note: Note) -> None:
+        self._flushed = True
+        if not note.id or (note.col.path, note.mid) not in self.watched:
+            return
+        with self.lock:
+            self.db.execute(
+                "insert into dirty (col, mid, nid) values (?, ?, ?)",
+                (note.col.path, note.mid, note.id),
+            )
+            self.db.commit()
+
+    def on_notes_will_be_deleted(self, col: Collection, nids: Sequence[NoteId]) -> None:
+        self._flushed = True
+        with self.lock:
+            spec_ids = [
+                spec_id
+                for (spec_id,) in self.db.execute(
+                    "select id from specs where dst_col = ?", (col.path,)
+                )
+            ]
+            for spec_id in spec_ids:
+                self.db.execute(
+                    f"delete from links where spec = ? and dst in {ids2str(nids)}",
+                    (spec_id,),
+                )
+            self.db.execute(f"delete from sources where nid in {ids2str(nids)}")
+            self.db.execute(f"delete from links where src in {ids2str(nids)}")
+            self.db.commit()
+
+    def on_notes_changed(self, col: Collection) -> None:
+        """Called after an operation changed the text of notes of the collection.
+        Notes edited by the backend alone (e.g. by Find & Replace, undo or a sync) don't go through
+        the hooks and can keep their modification time, so the links into the collection are dropped then."""
+        flushed, self._flushed = self._flushed, False
+        if not flushed:
+            self.invalidate(col)
+
+    def register_hooks(self) -> None:
+        hooks.note_will_flush.append(self.on_note_will_flush)
+        hooks.notes_will_be_deleted.append(self.on_notes_will_be_deleted)
+
+    def unregister_hooks(self) -> None:
+        hooks.note_will_flush.remove(self.on_note_will_flush)
+        hooks.notes_will_be_deleted.remove(self.on_notes_will_be_deleted)
+
+
+class LinkTableManager:
+    def __init__(self) -> None:
+        self._table: Optional[LinkTable] = None
+        self._path = ""
+
+    @property
+    def table(self) -> Optional[LinkTable]:
+        return self._table
+
+    @property
+    def path(self) -> str:
+        """Path of the add-on's sidecar database, which also keeps the signatures of bulk jobs."""
+        return self._path
+
+    def open(self, path: str) -> None:
+        self.close()
+        self._path = path
+        self._table = LinkTable(path)
+        self._table.register_hooks()
+
+    def close(self) -> None:
+        if self._table:
+            self._table.unregister_hooks()
+            self._table.close()
+            self._table = None
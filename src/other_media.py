@@ -0,0 +1,74 @@
+import html
+import os
+import re
+from typing import Any, Match
+from urllib.parse import quote
+
+from . import consts
+
+MEDIA_URL_PREFIX = f"/_{consts.FILTER_NAME}/media/"
+SRC_RE = re.compile(
+    r"""(?P<attr>\bsrc=)(?P<quote>["'])(?P<src>.*?)(?P=quote)""", re.IGNORECASE
+)
+SOUND_RE = re.compile(r"\[sound:(?P<filename>.+?)\]")
+# Sources that are not files in the media folder
+REMOTE_SRC_RE = re.compile(r"^(?:[a-z][a-z0-9+.-]*:|//|/)", re.IGNORECASE)
+
+_route_registered = False
+
+
+def serve_other_media(filename: str) -> Any:
+    import flask
+
+    from .gui import collection_manager
+
+    col = collection_manager.col
+    if not col:
+        flask.abort(404)
+    # send_from_directory() guards against paths outside the media folder
+    return flask.send_from_directory(col.media.dir(), filename)
+
+
+def register_media_route() -> None:
+    """Add a route to Anki's media server that serves files from the other collection's media folder."""
+    global _route_registered
+    try:
+        from aqt.mediasrv import app
+
+        app.add_url_rule(
+            f"{MEDIA_URL_PREFIX}<path:filename>",
+            f"{consts.FILTER_NAME}_other_media",
+            serve_other_media,
+        )
+        _route_registered = True
+    except Exception as exc:
+        # e.g. Flask refuses new routes after the server has handled a request
+        print(f"{consts.ADDON_NAME}: failed to register media route: {exc}")
+
+
+def serves_other_media() -> bool:
+    """Whether media of the other collection is referenced in place instead of being copied."""
+    return _route_registered and consts.CONFIG.get(
+        "serve_other_collection_media", False
+    )
+
+
+def rewrite_other_media(text: str, media_dir: str) -> str:
+    """Point media references in `text` to files served from `media_dir`, the other collection's media folder."""
+
+    def src_repl(match: Match) -> str:
+        src = match.group("src")
+        if REMOTE_SRC_RE.match(src):
+            return match.group(0)
+        url = MEDIA_URL_PREFIX + quote(html.unescape(src))
+        return f"{match.group('attr')}{match.group('quote')}{url}{match.group('quote')}"
+
+    def sound_repl(match: Match) -> str:
+        filename = match.group("filename")
+        if os.path.isabs(filename):
+            return match.group(0)
+        # the sound players resolve absolute paths as is
+        return f"[sound:{os.path.join(media_dir, filename)}]"
+
+    text = SRC_RE.sub(src_repl, text)
+    return SOUND_RE.sub(sound_repl, text)
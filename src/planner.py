@@ -0,0 +1,203 @@
+import re
+import threading
+import time
+import unicodedata
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Dict, Iterable, Optional, Sequence, Set, Tuple
+
+from anki.collection import Collection
+
+HTML_TAG_RE = re.compile(r"<[^>]*>")
+# Number of buckets of the hashed character and bigram frequency table
+STATS_BUCKETS = 1 << 16
+# Number of notes sampled to estimate the frequencies of a notetype
+STATS_SAMPLE_SIZE = 5000
+# Stats are rebuilt when the notetype's note count changes by more than this ratio
+STATS_STALE_RATIO = 0.1
+# Minimum number of seconds between checks of the note count
+STATS_CHECK_INTERVAL = 60
+# Shuffled queries expected to match more notes than this only rank a sample of them
+SAMPLED_SCAN_THRESHOLD = 8000
+# Number of matching notes ranked by a sampled scan
+SAMPLED_SCAN_ROWS = 2000
+# Number of ranges of notes, starting at random notes, that a sampled scan is split into,
+# so that the sample isn't made of notes added around the same time
+SAMPLED_SCAN_RANGES = 8
+# Size of the first page of a scan that can stop early; later pages grow up to the full page size
+MIN_SCAN_PAGE_SIZE = 32
+
+# Strategies picked by QueryPlanner.plan()
+STRATEGY_REFUSE = "refuse"
+STRATEGY_INDEX = "index"
+STRATEGY_SCAN = "scan"
+STRATEGY_SAMPLED = "sampled"
+
+
+def normalize_text(text: str) -> str:
+    # LIKE only folds the case of ASCII letters
+    return "".join(
+        c.lower() if c.isascii() else c for c in unicodedata.normalize("NFC", text)
+    )
+
+
+def features(text: str) -> Set[str]:
+    """Return the characters and bigrams of `text`."""
+    return set(text) | {text[i : i + 2] for i in range(len(text) - 1)}
+
+
+def is_searchable(text: str) -> bool:
+    """Whether `text` contains anything besides whitespace, punctuation and symbols.
+    Other terms would match nearly every note."""
+    return any(c.isalnum() for c in text)
+
+
+class TermStats:
+    """Estimated document frequencies of the characters and bigrams of a notetype's notes.
+
+    Frequencies are counted on a random sample of notes into a fixed number of hashed buckets,
+    so that they take constant memory. Hash collisions only make estimates larger.
+    """
+
+    def __init__(self, total: int, sampled: int, counts: "array[int]") -> None:
+        self.total = total
+        self.sampled = sampled
+        self.counts = counts
+        self.checked = time.monotonic()
+
+    @classmethod
+    def build(cls, col: Collection, mid: int) -> "TermStats":
+        total = col.db.scalar("select count() from notes where mid = ?", mid) or 0
+        counts = array("L", bytes(STATS_BUCKETS * array("L").itemsize))
+        sampled = 0
+        for (flds,) in col.db.all(
+            "select flds from notes where mid = ? order by random() limit ?",
+            mid,
+            STATS_SAMPLE_SIZE,
+        ):
+            text = normalize_text(HTML_TAG_RE.sub("", flds))
+            for bucket in {hash(f) % STATS_BUCKETS for f in features(text)}:
+                counts[bucket] += 1
+            sampled += 1
+        return cls(total, sampled, counts)
+
+    def estimate(self, text: str) -> int:
+        """Return the estimated number of notes containing `text`, which is at most the rarest
+        of its bigrams' frequency."""
+        if not self.sampled:
+            return 0
+        text = normalize_text(text)
+        terms: Iterable[str] = (
+            {text[i : i + 2] for i in range(len(text) - 1)} if len(text) > 1 else text
+        )
+        sample_count = min(
+            (self.counts[hash(f) % STATS_BUCKETS] for f in terms), default=self.sampled
+        )
+        return round(sample_count / self.sampled * self.total)
+
+
+@dataclass
+class Plan:
+    strategy: str
+    # estimated number of matching notes, or -1 if unknown
+    estimate: int = -1
+    # number of rows of the first page of the scan
+    page_size: int = 0
+    # maximum number of matching notes ranked by a sampled scan
+    max_rows: int = 0
+    # number of random ranges of notes a sampled scan is split into
+    ranges: int = 0
+
+
+class QueryPlanner:
+    """Picks how each lookup is run using term statistics that are built in the background."""
+
+    def __init__(self) -> None:
+        self._stats: Dict[Tuple[str, int], TermStats] = {}
+        self._building: Set[Tuple[str, int]] = set()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1)
+
+    def stats(self, col: Collection, mid: int) -> Optional[TermStats]:
+        """Return the stats of a notetype, scheduling a rebuild if they're missing or stale."""
+        key = (col.path, mid)
+        with self._lock:
+            stats = self._stats.get(key)
+            if stats and time.monotonic() - stats.checked < STATS_CHECK_INTERVAL:
+                return stats
+            if key in self._building:
+                return stats
+            self._building.add(key)
+        self._executor.submit(self._refresh, col, mid, key, stats)
+        return stats
+
+    def _refresh(
+        self,
+        col: Collection,
+        mid: int,
+        key: Tuple[str, int],
+        stats: Optional[TermStats],
+    ) -> None:
+        try:
+            if stats:
+                total = col.db.scalar("select count() from notes where mid = ?", mid)
+                if abs(total - stats.total) <= stats.total * STATS_STALE_RATIO:
+                    stats.checked = time.monotonic()
+                    return
+            stats = TermStats.build(col, mid)
+            with self._lock:
+                self._stats[key] = stats
+        except Exception:
+            # e.g. the collection was closed in the meantime
+            pass
+        finally:
+            with self._lock:
+                self._building.discard(key)
+
+    def plan(
+        self,
+        col: Collection,
+        mids: Sequence[int],
+        search_text: str,
+        max_notes: int,
+        ranked: bool,
+        index: bool = False,
+        exact: bool = False,
+        shuffled: bool = False,
+    ) -> Plan:
+        """Return how to run a lookup for `search_text`.
+        `ranked` is whether all matches have to be ranked (ordered or shuffled results),
+        and `index` whether the lookup can use an index.
+        Only `shuffled` lookups can rank a sample of their matches, as ordered ones
+        have to return the exact top results."""
+        if not is_searchable(search_text):
+            return Plan(STRATEGY_REFUSE)
+        if index:
+            return Plan(STRATEGY_INDEX)
+        all_stats = [self.stats(col, mid) for mid in mids]
+        estimate = -1
+        if all(all_stats):
+            estimate = sum(stats.estimate(search_text) for stats in all_stats)
+        if not ranked:
+            if max_notes < 0:
+                return Plan(STRATEGY_SCAN, estimate)
+            # only a few more matches than needed are fetched, in case some are rejected later
+            return Plan(
+                STRATEGY_SCAN,
+                estimate,
+                page_size=max(MIN_SCAN_PAGE_SIZE, max_notes * 2),
+            )
+        if (
+            shuffled
+            and not exact
+            and max_notes >= 0
+            and estimate > max(SAMPLED_SCAN_THRESHOLD, max_notes * 4)
+        ):
+            return Plan(
+                STRATEGY_SAMPLED,
+                estimate,
+                max_rows=SAMPLED_SCAN_ROWS,
+                ranges=SAMPLED_SCAN_RANGES,
+            )
+        return Plan(STRATEGY_SCAN, estimate)
@@ -0,0 +1,147 @@
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from anki.collection import Collection
+from anki.notes import NoteId
+
+from .copy_around import (
+    CopyAroundRelated,
+    Cursor,
+    RelatedNote,
+    Subs2srsOptions,
+    build_related_note,
+)
+
+# Maximum number of related notes kept for all webviews
+MAX_STORED_NOTES = 2000
+# Maximum number of webviews whose results are kept
+MAX_STORED_VIEWS = 8
+
+
+class StoredNote:
+    """The raw contents of a related note, keyed by field ordinal."""
+
+    __slots__ = ("nid", "ords", "contents")
+
+    def __init__(
+        self, nid: NoteId, ords: Tuple[int, ...], contents: Tuple[str, ...]
+    ) -> None:
+        self.nid = nid
+        self.ords = ords
+        self.contents = contents
+
+
+class StoredResults:
+    """The related notes found by a single filter of a rendered card.
+    Only what's needed to rebuild the notes when they're saved is kept."""
+
+    __slots__ = (
+        "notetype_name",
+        "copy_from_fields",
+        "subs2srs_info",
+        "use_other_col",
+        "notes",
+        "spec",
+        "cursor",
+        "contents",
+    )
+
+    def __init__(
+        self,
+        notetype_name: str = "",
+        copy_from_fields: Optional[List[str]] = None,
+        subs2srs_info: Optional[Subs2srsOptions] = None,
+        use_other_col: bool = False,
+        spec: Optional[Dict[str, Any]] = None,
+    ) -> None:
+        self.notetype_name = notetype_name
+        self.copy_from_fields = copy_from_fields or []
+        self.subs2srs_info = subs2srs_info
+        self.use_other_col = use_other_col
+        self.notes: Dict[NoteId, StoredNote] = {}
+        # options of the filter, used to look up its results when its buttons are clicked
+        self.spec = spec
+        # where the next page of results starts
+        self.cursor: Optional[Cursor] = None
+        # contents of a filter that ran over its time budget, shown in place of its placeholder once ready
+        self.contents: Optional[str] = None
+
+    def __len__(self) -> int:
+        return len(self.notes)
+
+    def add(self, col: Collection, rel: CopyAroundRelated) -> None:
+        """Store the related notes of `rel`, keeping the ones stored before."""
+        for nid, related_note in rel.related_notes.items():
+            names = [
+                name for name in related_note.fields if name in self.copy_from_fields
+            ]
+            # ordinals refer to the copied fields, which can be aliases of different fields
+            # when several notetypes are searched
+            self.notes[nid] = StoredNote(
+                nid,
+                tuple(self.copy_from_fields.index(name) for name in names),
+                tuple(related_note.fields[name].raw_contents for name in names),
+            )
+
+    def related_note(
+        self, col: Collection, nid: NoteId, other_col: Optional[Collection] = None
+    ) -> Optional[RelatedNote]:
+        """Rebuild a stored note, including its subs2srs context."""
+        stored = self.notes.get(nid)
+        mid = col.db.scalar("select mid from notes where id = ?", nid)
+        if not stored or not mid:
+            return None
+        dest_note = {
+            self.copy_from_fields[ord]: contents
+            for ord, contents in zip(stored.ords, stored.contents)
+        }
+        return build_related_note(
+            col,
+            mid,
+            nid,
+            dest_note,
+            self.copy_from_fields,
+            self.subs2srs_info,
+            other_col,
+        )
+
+
+class FilterResultsStore:
+    """The results of the filters of the card shown in each webview.
+    Results of the least recently rendered webviews are dropped
+    when more than MAX_STORED_NOTES notes are stored, and then the oldest notes
+    of the current one, e.g. when many pages of results were loaded."""
+
+    def __init__(
+        self, max_notes: int = MAX_STORED_NOTES, max_views: int = MAX_STORED_VIEWS
+    ) -> None:
+        self.max_notes = max_notes
+        self.max_views = max_views
+        self._views: "OrderedDict[int, List[StoredResults]]" = OrderedDict()
+
+    def reset(self, web: Any) -> List[StoredResults]:
+        """Start storing the results of a new render in `web`."""
+        results: List[StoredResults] = []
+        key = id(web)
+        self._views[key] = results
+        self._views.move_to_end(key)
+        self.evict()
+        return results
+
+    def get(self, web: Any) -> Optional[List[StoredResults]]:
+        return self._views.get(id(web))
+
+    def evict(self) -> None:
+        total = sum(len(r) for results in self._views.values() for r in results)
+        while len(self._views) > 1 and (
+            len(self._views) > self.max_views or total > self.max_notes
+        ):
+            _, results = self._views.popitem(last=False)
+            total -= sum(len(r) for r in results)
+        if total > self.max_notes:
+            current = next(reversed(self._views.values()))
+            while total > self.max_notes:
+                largest = max(current, key=len)
+                # notes are kept in the order they were stored
+                del largest.notes[next(iter(largest.notes))]
+                total -= 1
@@ -0,0 +1,86 @@
+import hashlib
+import json
+import sqlite3
+import threading
+from typing import Any, Dict, Iterable, List, Tuple
+
+from anki.collection import Collection
+from anki.notes import NoteId
+from anki.utils import ids2str
+
+from .copy_around import get_scope_condition
+
+SCHEMA = """
+create table if not exists signatures (
+    job text not null,
+    nid integer not null,
+    signature text not null,
+    primary key (job, nid)
+) without rowid;
+"""
+
+
+def make_signature(*parts: Any) -> str:
+    data = json.dumps(parts, ensure_ascii=False)
+    return hashlib.sha1(data.encode("utf-8")).hexdigest()
+
+
+def targets_state(col: Collection, mids: Iterable[int], deck: str = "") -> List:
+    """Return values that change whenever notes of the given notetypes are added, edited, deleted or synced.
+    With a `deck`, they also change when cards of these notes are moved in or out of it, but not when they're reviewed."""
+    mid_list = ids2str(mids)
+    state = [
+        col.path,
+        *col.db.first(
+            f"select count(), max(mod), max(usn) from notes where mid in {mid_list}"
+        ),
+    ]
+    if deck:
+        scope = get_scope_condition(col, deck, "", "")
+        if scope is None:
+            state.append(None)
+        else:
+            condition, params = scope
+            state.extend(
+                col.db.first(
+                    f"select count(), total(n.id) from notes n where n.mid in {mid_list} and {condition}",
+                    *params,
+                )
+            )
+    return state
+
+
+class SignatureStore:
+    """Signatures of the inputs of a bulk job's last run on each note, kept in the add-on's sidecar database.
+
+    A note whose signature didn't change since the last run would get the same results,
+    so re-runs can skip it.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.executescript(SCHEMA)
+
+    def close(self) -> None:
+        with self.lock:
+            self.db.commit()
+            self.db.close()
+
+    def get(self, job: str) -> Dict[NoteId, str]:
+        with self.lock:
+            return {
+                NoteId(nid): signature
+                for nid, signature in self.db.execute(
+                    "select nid, signature from signatures where job = ?", (job,)
+                )
+            }
+
+    def put(self, job: str, signatures: Iterable[Tuple[NoteId, str]]) -> None:
+        with self.lock:
+            self.db.executemany(
+                "insert or replace into signatures (job, nid, signature) values (?, ?, ?)",
+                ((job, nid, signature) for nid, signature in signatures),
+            )
+            self.db.commit()
@@ -0,0 +1,126 @@
+import hashlib
+import html
+import os
+import re
+import threading
+from typing import Match, Optional, Set
+
+from aqt.qt import QImageReader, Qt
+
+from . import consts
+
+IMG_RE = re.compile(
+    r"""<img\b(?P<before>[^>]*?)\bsrc=(?P<quote>["'])(?P<src>.*?)(?P=quote)(?P<after>[^>]*)>""",
+    re.IGNORECASE,
+)
+# Sources that are not files in the media folder
+REMOTE_SRC_RE = re.compile(r"^(?:[a-z][a-z0-9+.-]*:|//)", re.IGNORECASE)
+THUMBNAILS_FOLDER = "thumbnails"
+# Swaps the thumbnail with the full image on click
+IMG_ONCLICK = (
+    "if(this.dataset.full){this.src=this.dataset.full;delete this.dataset.full;}"
+)
+
+
+class ThumbnailCache:
+    """Downscaled copies of media images, stored in the add-on's user_files folder.
+    The least recently used thumbnails are evicted when the folder exceeds `max_bytes`."""
+
+    def __init__(self, folder: str, max_size: int, max_bytes: int) -> None:
+        self.folder = folder
+        self.max_size = max_size
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self._total_bytes: Optional[int] = None
+        # images that don't need a thumbnail or failed to load
+        self._skipped: Set[str] = set()
+
+    @property
+    def url_prefix(self) -> str:
+        return f"/_addons/{consts.ADDON_PACKAGE}/user_files/{THUMBNAILS_FOLDER}/"
+
+    def _name(self, path: str) -> Optional[str]:
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        key = f"{path}:{stat.st_size}:{stat.st_mtime}:{self.max_size}"
+        ext = ".jpg" if path.lower().endswith((".jpg", ".jpeg")) else ".png"
+        return hashlib.sha1(key.encode("utf-8")).hexdigest()[:20] + ext
+
+    def _folder_size(self) -> int:
+        if self._total_bytes is None:
+            self._total_bytes = sum(
+                entry.stat().st_size for entry in os.scandir(self.folder)
+            )
+        return self._total_bytes
+
+    def _evict(self) -> None:
+        if self._folder_size() <= self.max_bytes:
+            return
+        entries = sorted(os.scandir(self.folder), key=lambda e: e.stat().st_mtime)
+        for entry in entries:
+            if self._total_bytes <= self.max_bytes:
+                break
+            size = entry.stat().st_size
+            try:
+                os.remove(entry.path)
+            except OSError:
+                continue
+            self._total_bytes -= size
+
+    def thumbnail(self, path: str) -> Optional[str]:
+        """Return the file name of the thumbnail of the image at `path`, creating it if needed.
+        Returns None if the image is already small enough or can't be read."""
+        name = self._name(path)
+        if not name:
+            return None
+        thumb_path = os.path.join(self.folder, name)
+        with self.lock:
+            os.makedirs(self.folder, exist_ok=True)
+            if os.path.exists(thumb_path):
+                # keep track of recently used thumbnails for eviction
+                os.utime(thumb_path)
+                return name
+            if name in self._skipped:
+                return None
+            # read the size first to avoid decoding small images
+            reader = QImageReader(path)
+            size = reader.size()
+            if not size.isValid() or (
+                size.width() <= self.max_size and size.height() <= self.max_size
+            ):
+                self._skipped.add(name)
+                return None
+            reader.setScaledSize(
+                size.scaled(
+                    self.max_size, self.max_size, Qt.AspectRatioMode.KeepAspectRatio
+                )
+            )
+            image = reader.read()
+            total_bytes = self._folder_size()
+            if image.isNull() or not image.save(thumb_path):
+                self._skipped.add(name)
+                return None
+            self._total_bytes = total_bytes + os.path.getsize(thumb_path)
+            self._evict()
+        return name
+
+    def rewrite_images(self, text: str, media_dir: str) -> str:
+        """Point images in `text` to their thumbnails, loading the full image on click."""
+
+        def repl(match: Match) -> str:
+            src = match.group("src")
+            if REMOTE_SRC_RE.match(src):
+                return match.group(0)
+            name = self.thumbnail(os.path.join(media_dir, html.unescape(src)))
+            if not name:
+                return match.group(0)
+            quote = match.group("quote")
+            return (
+                f"<img{match.group('before')}src={quote}{self.url_prefix}{name}{quote}"
+                f' data-full={quote}{src}{quote} loading="lazy" onclick="{IMG_ONCLICK}"'
+                f"{match.group('after')}>"
+            )
+
+        return IMG_RE.sub(repl, text)